@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Agrégation des échanges réseau par pays et par domaine
+
+Les graphes (et les rapports texte) n'ont besoin que de quelques sommes et comptages par pays et par domaine.
+Ils sont calculés ici en un seul groupby par clé, au lieu d'un groupby par graphe.
+
+Les temps de chaque échange donnent aussi la contribution de chaque pays / domaine au chargement des pages :
+    - temps total et temps d'attente du serveur (timings.wait), avec ses quantiles p50/p95
+    - temps sur le chemin critique avant l'évènement onLoad : durée pendant laquelle au moins une requete vers ce pays / domaine
+      était en cours entre le début de la page et onLoad (union des intervalles des requetes, calculée par page)
+    - taux de réutilisation des connexions : proportion d'échanges qui n'ont pas ouvert de connexion (timings.connect à -1 ou nul),
+      parmi les échanges dont les timings sont connus (un échange sans timings, ex : table construite sans COLONNES_ENTREE, n'est pas compté)
+Tous les agrégats sont des sommes : les agrégats de plusieurs fichiers peuvent donc être fusionnés en les additionnant
+(voir fusionne_agregats). Les quantiles des temps d'attente sont exacts pour un fichier ; après fusion, ceux d'un pays / domaine
+présent dans plusieurs fichiers sont estimés à partir d'un histogramme des temps d'attente (additionné lui aussi), et limités
+aux temps d'attente minimal et maximal observés.
+"""
+
+import json # pour l'export des agrégats
+import numpy as np # pour les calculs vectorisés
+import pandas as pd # pour l'analyse de données
+
+
+COLONNES_AGREGATS = ['requestSize', 'responseSize', 'contentSize', 'count', 'time', 'wait', 'critique', 'mesures', 'reutilisations']
+# Colonnes calculées à partir des précédentes (voir Agregats.latences)
+COLONNES_LATENCES = ['wait_p50', 'wait_p95', 'taux_reutilisation']
+# Statistiques exactes des temps d'attente de chaque pays / domaine (quantiles à NaN si elles ne sont plus exactes après fusion)
+COLONNES_STATS_ATTENTE = ['wait_min', 'wait_max', 'wait_p50', 'wait_p95']
+# Bornes (ms) des classes de l'histogramme des temps d'attente : progression géométrique de raison ~1.1 de 0.1 ms à 10 min,
+# soit une erreur d'au plus 10% (la largeur d'une classe) sur les quantiles estimés après fusion (la première classe isole les attentes nulles)
+BORNES_ATTENTE = np.concatenate(([0.0, 1e-3], np.geomspace(0.1, 600000, 161), [np.inf]))
+NB_CLASSES = len(BORNES_ATTENTE) - 1
+
+
+class Agregats:
+    '''
+    Résultat de l'agrégation des échanges : volumes envoyés/reçus sur le réseau et volume décodé des réponses (contentSize) en octets,
+    nombre d'échanges et temps (en ms), par pays et par domaine
+        Attributes :
+            par_pays (pd.DataFrame) : une ligne par pays, colonnes COLONNES_AGREGATS
+            par_domaine (pd.DataFrame) : une ligne par domaine, mêmes colonnes
+            attente_pays (pd.DataFrame) : une ligne par pays, une colonne par classe de l'histogramme des temps d'attente (BORNES_ATTENTE)
+            attente_domaine (pd.DataFrame) : une ligne par domaine, mêmes colonnes
+            stats_pays (pd.DataFrame) : une ligne par pays, colonnes COLONNES_STATS_ATTENTE
+            stats_domaine (pd.DataFrame) : une ligne par domaine, mêmes colonnes
+    '''
+
+    def __init__(self, par_pays, par_domaine, attente_pays=None, attente_domaine=None, stats_pays=None, stats_domaine=None):
+        self.par_pays = par_pays
+        self.par_domaine = par_domaine
+        self.attente_pays = histogramme_vide(par_pays.index) if attente_pays is None else attente_pays
+        self.attente_domaine = histogramme_vide(par_domaine.index) if attente_domaine is None else attente_domaine
+        self.stats_pays = pd.DataFrame(index=par_pays.index, columns=COLONNES_STATS_ATTENTE, dtype='float64') if stats_pays is None else stats_pays
+        self.stats_domaine = pd.DataFrame(index=par_domaine.index, columns=COLONNES_STATS_ATTENTE, dtype='float64') if stats_domaine is None else stats_domaine
+
+    @property
+    def nb_domain(self):
+        '''
+        Nombre de domaines distincts contactés
+        '''
+        return len(self.par_domaine)
+
+    def serie(self, cle, colonne):
+        '''
+        Retourne une colonne d'agrégats triée par ordre croissant (ordre d'affichage des graphes)
+            Parameters :
+                cle (string) : 'country' ou 'domain'
+                colonne (string) : 'requestSize', 'responseSize' ou 'count'
+            Returns :
+                data (pd.Series) : la série triée
+        '''
+        table = self.par_pays if cle == 'country' else self.par_domaine
+        return table[colonne].sort_values(ascending=True)
+
+    def latences(self, cle):
+        '''
+        Retourne la contribution de chaque pays / domaine au temps de chargement des pages, du plus pénalisant au moins pénalisant
+            Parameters :
+                cle (string) : 'country' ou 'domain'
+            Returns :
+                table (pd.DataFrame) : colonnes count, time, wait (totaux en ms), wait_p50, wait_p95 (ms), critique (ms sur le chemin critique avant onLoad)
+                    et taux_reutilisation (proportion d'échanges sur une connexion déjà ouverte, parmi ceux dont les timings sont connus)
+        '''
+        if cle == 'country':
+            table, attente, stats = self.par_pays, self.attente_pays, self.stats_pays
+        else:
+            table, attente, stats = self.par_domaine, self.attente_domaine, self.stats_domaine
+        resultat = table[['count', 'time', 'wait', 'critique']].copy()
+        histogrammes = attente.reindex(table.index, fill_value=0).to_numpy()
+        stats = stats.reindex(table.index)
+        for colonne, q in (('wait_p50', 0.5), ('wait_p95', 0.95)):
+            # Quantile exact s'il est connu, estimé à partir de l'histogramme (dans les limites observées) sinon
+            estimation = quantiles_histogramme(histogrammes, q)
+            estimation = np.where(np.isnan(estimation), np.nan, np.fmin(np.fmax(estimation, stats['wait_min'].to_numpy()), stats['wait_max'].to_numpy()))
+            resultat[colonne] = stats[colonne].fillna(pd.Series(estimation, index=table.index))
+        resultat['taux_reutilisation'] = table['reutilisations'] / table['mesures'].where(table['mesures'] > 0)
+        return resultat.sort_values('critique', ascending=False)
+
+    def to_dict(self):
+        '''
+        Retourne les agrégats sous forme de dictionnaire (sérialisable en JSON)
+            Returns :
+                resultats (dict) : nb_domain, et pour chaque pays / domaine ses volumes (octets), son nombre d'échanges et ses temps (ms)
+        '''
+        def lignes(cle, table):
+            table = table[COLONNES_AGREGATS].join(self.latences(cle)[COLONNES_LATENCES])
+            table = table.astype(object).where(table.notna(), None) # NaN (ex : quantile sans attente mesurée) -> null
+            return {str(valeur) : ligne for valeur, ligne in table.to_dict(orient='index').items()}
+        return {'nb_domain' : self.nb_domain,
+                'par_pays' : lignes('country', self.par_pays),
+                'par_domaine' : lignes('domain', self.par_domaine)}
+
+    def to_frame(self):
+        '''
+        Retourne les agrégats dans une seule table (une ligne par pays puis une ligne par domaine)
+            Returns :
+                table (pd.DataFrame) : colonnes ['cle', 'valeur'] + COLONNES_AGREGATS + COLONNES_LATENCES
+        '''
+        tables = []
+        for cle, table in (('country', self.par_pays), ('domain', self.par_domaine)):
+            table = table[COLONNES_AGREGATS].join(self.latences(cle)[COLONNES_LATENCES]).rename_axis('valeur').reset_index()
+            table['valeur'] = table['valeur'].astype(str)
+            table.insert(0, 'cle', cle)
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True)
+
+
+def histogramme_vide(index):
+    '''
+    Retourne un histogramme des temps d'attente sans aucun échange, pour les valeurs d'un index
+    '''
+    return pd.DataFrame(np.zeros((len(index), NB_CLASSES), dtype=np.int64), index=index)
+
+
+def quantiles_histogramme(histogrammes, q):
+    '''
+    Calcule un quantile à partir d'histogrammes des temps d'attente (interpolation linéaire dans la classe du quantile)
+        Parameters :
+            histogrammes (np.ndarray) : une ligne par histogramme, une colonne par classe de BORNES_ATTENTE
+            q (float) : le quantile (ex : 0.95)
+        Returns :
+            quantiles (np.ndarray) : le quantile de chaque histogramme (ms), NaN pour un histogramme vide
+    '''
+    histogrammes = np.asarray(histogrammes, dtype=np.float64).reshape(-1, NB_CLASSES)
+    cumul = histogrammes.cumsum(axis=1)
+    total = cumul[:, -1]
+    cible = q * total
+    classe = np.minimum((cumul < cible[:, None]).sum(axis=1), NB_CLASSES - 1) # première classe où le cumul atteint la cible
+    dans_classe = np.take_along_axis(histogrammes, classe[:, None], axis=1)[:, 0]
+    avant = np.take_along_axis(cumul, classe[:, None], axis=1)[:, 0] - dans_classe
+    bas = BORNES_ATTENTE[classe]
+    haut = BORNES_ATTENTE[classe + 1]
+    haut = np.where(np.isinf(haut), bas, haut)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(dans_classe > 0, (cible - avant) / dans_classe, 0.0)
+    return np.where(total > 0, bas + fraction * (haut - bas), np.nan)
+
+
+def contributions_critiques(df, cle):
+    '''
+    Calcule pour chaque échange sa contribution au temps du chemin critique de son pays / domaine :
+    la partie de l'intervalle [début, fin] de l'échange, limitée à [début de la page, onLoad], qui n'est pas déjà couverte
+    par un échange de la même page et du même pays / domaine commencé avant lui. La somme par clé donne donc la durée
+    de l'union des intervalles de la clé.
+        Parameters :
+            df (pd.DataFrame) : le dataframe des échanges (colonnes startedDateTime, time, page, pageStartedDateTime, onLoad)
+            cle (string) : 'country' ou 'domain'
+        Returns :
+            contributions (np.ndarray) : la contribution de chaque échange (ms)
+    '''
+    onload = df['onLoad'].to_numpy(dtype=np.float64)
+    debut = ((df['startedDateTime'] - df['pageStartedDateTime']) / pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.float64)
+    fin = debut + df['time'].to_numpy(dtype=np.float64)
+    # Intervalles limités à [0, onLoad] ; sans onLoad ou sans date, l'échange ne contribue pas (intervalle vide)
+    debut = np.nan_to_num(np.clip(debut, 0, onload), nan=0.0)
+    fin = np.nan_to_num(np.clip(fin, 0, onload), nan=0.0)
+    fin = np.maximum(debut, fin)
+    # Tri par (page, clé, début) : dans chaque groupe, la fin la plus tardive des échanges précédents est un maximum cumulé
+    groupe = df['page'].cat.codes.to_numpy(dtype=np.int64) * (len(df[cle].cat.categories) + 1) + df[cle].cat.codes.to_numpy(dtype=np.int64)
+    ordre = np.lexsort((debut, groupe))
+    groupe, debut_trie, fin_triee = groupe[ordre], debut[ordre], fin[ordre]
+    fin_precedente = pd.Series(fin_triee).groupby(groupe).cummax().shift(1).to_numpy(dtype=np.float64, copy=True)
+    nouveau_groupe = np.ones(len(groupe), dtype=bool)
+    nouveau_groupe[1:] = groupe[1:] != groupe[:-1]
+    fin_precedente[nouveau_groupe] = -np.inf
+    contributions = np.empty(len(ordre))
+    contributions[ordre] = np.maximum(fin_triee - np.maximum(debut_trie, fin_precedente), 0.0)
+    return contributions
+
+
+def agrege(df, cle):
+    '''
+    Calcule en un seul passage les sommes (tailles, temps) et le nombre d'échanges pour chaque valeur d'une clé
+        Parameters :
+            df (pd.DataFrame) : le dataframe des échanges
+            cle (string) : la colonne servant au regroupement ('country' ou 'domain')
+        Returns :
+            table (pd.DataFrame) : une ligne par valeur de la clé, colonnes COLONNES_AGREGATS
+            attente (pd.DataFrame) : une ligne par valeur de la clé, histogramme des temps d'attente (une colonne par classe)
+            stats (pd.DataFrame) : une ligne par valeur de la clé, temps d'attente minimal, maximal et quantiles exacts (COLONNES_STATS_ATTENTE)
+    '''
+    # Echanges dont les timings sont connus : timings.wait est toujours renseigné (jamais -1) dans une entrée HAR, et NaN sans timings
+    mesures = df['wait'].notna()
+    colonnes = pd.DataFrame({
+        cle : df[cle],
+        'requestSize' : df['requestSize'],
+        'responseSize' : df['responseSize'],
+        'contentSize' : df['contentSize'],
+        'time' : df['time'],
+        'wait' : df['wait'],
+        'critique' : contributions_critiques(df, cle),
+        'mesures' : mesures,
+        'reutilisations' : mesures & ~(df['connect'] > 0), # connect à -1 (NaN dans la table) ou nul : pas de nouvelle connexion
+    })
+    groupes = colonnes.groupby(cle, observed=True)
+    table = groupes.sum()
+    table['count'] = groupes.size()
+    table = table[COLONNES_AGREGATS]
+    # Histogramme des temps d'attente : un seul bincount sur (code de la clé, classe)
+    codes = table.index.get_indexer(df[cle])
+    attente = df['wait'].to_numpy(dtype=np.float64)
+    valides = ~np.isnan(attente)
+    classes = np.searchsorted(BORNES_ATTENTE, attente[valides], side='right') - 1
+    comptes = np.bincount(codes[valides] * NB_CLASSES + classes, minlength=len(table) * NB_CLASSES)
+    attentes = groupes['wait']
+    stats = pd.DataFrame({'wait_min' : attentes.min(), 'wait_max' : attentes.max()})
+    if len(stats):
+        quantiles = attentes.quantile([0.5, 0.95]).unstack()
+        stats['wait_p50'], stats['wait_p95'] = quantiles[0.5], quantiles[0.95]
+    else:
+        stats['wait_p50'] = stats['wait_p95'] = pd.Series(dtype='float64')
+    return table, pd.DataFrame(comptes.reshape(len(table), NB_CLASSES), index=table.index), stats.reindex(table.index)[COLONNES_STATS_ATTENTE]
+
+
+def calcule_agregats(df):
+    '''
+    Calcule les agrégats par pays et par domaine d'un dataframe d'échanges
+        Parameters :
+            df (pd.DataFrame) : un dataframe d'échanges (voir TableEchanges.to_dataframe)
+        Returns :
+            agregats (Agregats) : les agrégats
+    '''
+    par_pays, attente_pays, stats_pays = agrege(df, 'country')
+    par_domaine, attente_domaine, stats_domaine = agrege(df, 'domain')
+    return Agregats(par_pays, par_domaine, attente_pays, attente_domaine, stats_pays, stats_domaine)
+
+
+def exporte_agregats(agregats, fichier, format_sortie="json"):
+    '''
+    Ecrit les agrégats dans un fichier JSON ou CSV (sortie sans graphe, pour les traitements par lots)
+        Parameters :
+            agregats (Agregats) : les agrégats
+            fichier (string) : le fichier à écrire
+            format_sortie (string) : "json" ou "csv"
+    '''
+    if format_sortie == "json":
+        with open(fichier, 'w', encoding="utf-8") as f:
+            json.dump(agregats.to_dict(), f, indent=2)
+    elif format_sortie == "csv":
+        agregats.to_frame().to_csv(fichier, index=False)
+    else:
+        raise ValueError(f"Format de sortie inconnu : {format_sortie}")
+
+
+def fusionne_agregats(liste_agregats):
+    '''
+    Fusionne des agrégats partiels (par exemple un par fichier HAR) en additionnant les sommes, les comptages et les histogrammes
+    Les quantiles exacts d'un pays / domaine ne sont gardés que s'il n'est présent que dans un des agrégats
+        Parameters :
+            liste_agregats : un itérable d'Agregats
+        Returns :
+            agregats (Agregats) : les agrégats fusionnés
+    '''
+    liste_agregats = list(liste_agregats)
+    if not liste_agregats:
+        vide = pd.DataFrame(columns=COLONNES_AGREGATS, dtype='int64')
+        return Agregats(vide, vide.copy())
+    def fusionne(tables):
+        return pd.concat(tables).groupby(level=0).sum()
+    def fusionne_stats(tables):
+        groupes = pd.concat(tables).groupby(level=0)
+        stats = groupes.agg({'wait_min' : 'min', 'wait_max' : 'max', 'wait_p50' : 'first', 'wait_p95' : 'first'})
+        stats.loc[groupes.size() > 1, ['wait_p50', 'wait_p95']] = np.nan # quantiles de plusieurs fichiers : estimés par l'histogramme
+        return stats
+    return Agregats(fusionne([a.par_pays for a in liste_agregats]),
+                    fusionne([a.par_domaine for a in liste_agregats]),
+                    fusionne([a.attente_pays for a in liste_agregats]),
+                    fusionne([a.attente_domaine for a in liste_agregats]),
+                    fusionne_stats([a.stats_pays for a in liste_agregats]),
+                    fusionne_stats([a.stats_domaine for a in liste_agregats]))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Agrégation en continu des échanges réseau, en mémoire bornée
+
+L'agrégation de agregation.py part de la table complète des échanges. Pour un flux d'entrées sans fin (capture continue),
+AgregatsContinus met à jour ses agrégats à chaque échange analysé, sans rien conserver de l'échange lui-meme :
+    - par pays : sommes et comptages exacts (le nombre de pays est borné)
+    - par domaine : les domaines les plus importants pour chaque colonne (volume envoyé, volume reçu, nombre d'échanges),
+      suivis par un algorithme Space-Saving pondéré (voir SpaceSaving) : valeurs surestimées d'au plus total / capacité
+    - nombre de domaines distincts : estimé par HyperLogLog (erreur relative d'environ 1.04 / sqrt(2^PRECISION_HLL))
+La mémoire reste donc constante quel que soit le nombre d'entrées. Les agrégats s'utilisent comme ceux de agregation.Agregats
+pour les graphes et les exports (serie, nb_domain, to_dict, to_frame).
+"""
+
+import hashlib # pour le hachage des domaines (HyperLogLog)
+import heapq # pour retrouver le compteur minimal de Space-Saving
+import math # pour l'estimation HyperLogLog
+from functools import lru_cache # pour ne hacher qu'une fois les domaines fréquents
+import pandas as pd # pour l'analyse de données
+
+
+# Colonnes agrégées en continu
+COLONNES_CONTINUES = ['requestSize', 'responseSize', 'count']
+# Nombre de domaines affichés par les graphes
+NB_PREMIERS = 15
+# Nombre de domaines suivis par chaque Space-Saving, par domaine affiché : plus il est grand, plus le classement est exact
+FACTEUR_SURVEILLANCE = 10
+# HyperLogLog : 2^PRECISION_HLL registres d'un octet (4 Ko, erreur relative d'environ 1.6%)
+PRECISION_HLL = 12
+# Nombre de domaines dont le hachage est gardé en cache
+TAILLE_CACHE_HACHAGE = 4096
+
+
+@lru_cache(maxsize=TAILLE_CACHE_HACHAGE)
+def hachage_64(valeur):
+    '''
+    Retourne un hachage de 64 bits d'une chaine (BLAKE2b, stable d'une exécution à l'autre contrairement à hash)
+    '''
+    return int.from_bytes(hashlib.blake2b(valeur.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    '''
+    Estimation du nombre de valeurs distinctes d'un flux en mémoire constante (2^precision registres)
+    '''
+
+    def __init__(self, precision=PRECISION_HLL):
+        self.precision = precision
+        self.nb_registres = 1 << precision
+        self.registres = bytearray(self.nb_registres)
+
+    def ajoute(self, valeur):
+        '''
+        Ajoute une valeur (chaine) au flux
+        '''
+        h = hachage_64(valeur)
+        registre = h >> (64 - self.precision)
+        reste = h & ((1 << (64 - self.precision)) - 1)
+        rang = 64 - self.precision - reste.bit_length() + 1 # position du premier bit à 1
+        if rang > self.registres[registre]:
+            self.registres[registre] = rang
+
+    def fusionne(self, autre):
+        '''
+        Ajoute les valeurs d'un autre HyperLogLog de meme précision (union des flux)
+        '''
+        self.registres = bytearray(max(a, b) for a, b in zip(self.registres, autre.registres))
+
+    def estimation(self):
+        '''
+        Retourne le nombre estimé de valeurs distinctes
+        '''
+        m = self.nb_registres
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimation = alpha * m * m / sum(2.0 ** -r for r in self.registres)
+        vides = self.registres.count(0)
+        if estimation <= 2.5 * m and vides:
+            estimation = m * math.log(m / vides) # petites cardinalités : comptage linéaire, quasi exact
+        return round(estimation)
+
+
+class SpaceSaving:
+    '''
+    Suivi des valeurs les plus lourdes d'un flux pondéré (algorithme Space-Saving) avec un nombre fixe de compteurs
+    Une valeur non suivie remplace la valeur suivie de plus faible poids et hérite de son poids : le poids d'une valeur suivie
+    est surestimé d'au plus son erreur, elle-meme inférieure à total / capacite.
+    '''
+
+    def __init__(self, capacite):
+        self.capacite = capacite
+        self.compteurs = {} # valeur -> [poids estimé, erreur maximale]
+        self.tas = [] # (poids, valeur) : un élément par valeur suivie, poids éventuellement périmé (mis à jour à la demande)
+
+    def ajoute(self, valeur, poids=1):
+        '''
+        Ajoute le poids d'une valeur du flux
+        '''
+        compteur = self.compteurs.get(valeur)
+        if compteur is not None:
+            compteur[0] += poids # le tas n'est corrigé que lorsque cet élément arrive au sommet
+            return
+        if len(self.compteurs) < self.capacite:
+            self.compteurs[valeur] = [poids, 0]
+            heapq.heappush(self.tas, (poids, valeur))
+            return
+        while True:
+            minimum, valeur_min = self.tas[0]
+            actuel = self.compteurs[valeur_min][0]
+            if actuel == minimum:
+                break
+            heapq.heapreplace(self.tas, (actuel, valeur_min))
+        del self.compteurs[valeur_min]
+        self.compteurs[valeur] = [minimum + poids, minimum]
+        heapq.heapreplace(self.tas, (minimum + poids, valeur))
+
+    def premiers(self, nb):
+        '''
+        Retourne les nb valeurs de plus fort poids estimé
+            Returns :
+                premiers (list) : (valeur, poids estimé) par poids décroissant
+        '''
+        return heapq.nlargest(nb, ((v, c[0]) for v, c in self.compteurs.items()), key=lambda p: p[1])
+
+    def poids(self, valeur):
+        '''
+        Retourne le poids estimé d'une valeur, ou None si elle n'est pas suivie
+        '''
+        compteur = self.compteurs.get(valeur)
+        return None if compteur is None else compteur[0]
+
+
+class AgregatsContinus:
+    '''
+    Agrégats par pays et par domaine mis à jour à chaque échange (voir l'en-tete du module)
+    '''
+
+    def __init__(self, nb_premiers=NB_PREMIERS, facteur=FACTEUR_SURVEILLANCE, precision=PRECISION_HLL):
+        '''
+        Parameters :
+            nb_premiers (int) : le nombre de domaines retournés pour chaque colonne
+            facteur (int) : le nombre de domaines suivis par domaine retourné (voir FACTEUR_SURVEILLANCE)
+            precision (int) : la précision de l'estimation du nombre de domaines (voir PRECISION_HLL)
+        '''
+        self.nb_premiers = nb_premiers
+        self.par_pays = {} # pays -> [requestSize, responseSize, count]
+        self.par_domaine = {colonne : SpaceSaving(nb_premiers * facteur) for colonne in COLONNES_CONTINUES}
+        self.domaines = HyperLogLog(precision)
+        self.nb_echanges = 0
+
+    def ajoute(self, res):
+        '''
+        Ajoute un échange
+            Parameters :
+                res (list) : les attributs de l'échange (résultat de analyse_entry : hostname, tld, domain, requestSize, responseSize, country ...)
+        '''
+        domaine, requestSize, responseSize, pays = res[2], res[3], res[4], res[5]
+        sommes = self.par_pays.get(pays)
+        if sommes is None:
+            sommes = self.par_pays[pays] = [0, 0, 0]
+        sommes[0] += requestSize
+        sommes[1] += responseSize
+        sommes[2] += 1
+        self.par_domaine['requestSize'].ajoute(domaine, requestSize)
+        self.par_domaine['responseSize'].ajoute(domaine, responseSize)
+        self.par_domaine['count'].ajoute(domaine, 1)
+        self.domaines.ajoute(domaine)
+        self.nb_echanges += 1
+
+    @property
+    def nb_domain(self):
+        '''
+        Nombre estimé de domaines distincts contactés
+        '''
+        return self.domaines.estimation()
+
+    def serie(self, cle, colonne):
+        '''
+        Retourne une colonne d'agrégats triée par ordre croissant (ordre d'affichage des graphes), comme Agregats.serie
+        Par domaine, seuls les nb_premiers domaines de la colonne sont retournés (valeurs estimées)
+            Parameters :
+                cle (string) : 'country' ou 'domain'
+                colonne (string) : une des COLONNES_CONTINUES
+            Returns :
+                data (pd.Series) : la série triée
+        '''
+        if cle == 'country':
+            i = COLONNES_CONTINUES.index(colonne)
+            data = pd.Series({pays : sommes[i] for pays, sommes in self.par_pays.items()}, dtype='int64')
+        else:
+            data = pd.Series(dict(self.par_domaine[colonne].premiers(self.nb_premiers)), dtype='int64')
+        return data.rename_axis(cle).rename(colonne).sort_values(ascending=True)
+
+    def table_domaines(self):
+        '''
+        Retourne les domaines retenus (les nb_premiers de chaque colonne) avec leurs valeurs estimées (None si le domaine
+        n'est plus suivi pour une colonne)
+        '''
+        domaines = dict.fromkeys(d for colonne in COLONNES_CONTINUES for d, _ in self.par_domaine[colonne].premiers(self.nb_premiers))
+        return pd.DataFrame({colonne : [self.par_domaine[colonne].poids(d) for d in domaines] for colonne in COLONNES_CONTINUES},
+                            index=pd.Index(list(domaines), name='domain'), dtype=object)
+
+    def to_dict(self):
+        '''
+        Retourne les agrégats sous forme de dictionnaire (sérialisable en JSON), dans le format de Agregats.to_dict
+        '''
+        return {'nb_domain' : self.nb_domain,
+                'par_pays' : {str(pays) : dict(zip(COLONNES_CONTINUES, sommes)) for pays, sommes in self.par_pays.items()},
+                'par_domaine' : {str(d) : ligne for d, ligne in self.table_domaines().to_dict(orient='index').items()}}
+
+    def to_frame(self):
+        '''
+        Retourne les agrégats dans une seule table (une ligne par pays puis une ligne par domaine retenu), comme Agregats.to_frame
+        '''
+        pays = pd.DataFrame.from_dict(self.par_pays, orient='index', columns=COLONNES_CONTINUES).rename_axis('valeur').reset_index()
+        pays.insert(0, 'cle', 'country')
+        domaines = self.table_domaines().rename_axis('valeur').reset_index()
+        domaines.insert(0, 'cle', 'domain')
+        return pd.concat([pays, domaines], ignore_index=True)
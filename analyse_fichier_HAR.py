@@ -7,78 +7,217 @@ Created on Thu Dec  1 10:48:05 2022
 """
 
 import IP2Location # pour géolocaliser un serveur à partir d'une adresse IP
-import json # necessaire pour HarPage
-from haralyzer import HarPage # pour lire le fichier .har
-import numpy as np #  pour l'analyse de données
-import matplotlib.pyplot as plt #  pour créer des graphs
-import pandas as pd # pour l'analyse de données
+import mmap # pour projeter les bases IP2Location en mémoire en lecture seule
+import os # pour identifier le processus courant
+import sys # pour instrumenter les fonctions de ce module (profilage)
+import atexit # pour écrire le cache de géolocalisation en fin d'exécution
+import logging # pour les messages de diagnostic
+from functools import lru_cache # pour ne pas géolocaliser plusieurs fois la même adresse IP
+from lecture_har import iter_entries, EntreeHAR # pour parcourir les entrées du fichier .har et accéder à leurs champs
+from index_ip import IndexIP # index en mémoire des bases IP2Location
+from cache_geoloc import CacheGeoloc # cache de géolocalisation conservé sur disque
+from suffixes_publics import get_registrable_domain, retire_port # domaine enregistrable à partir de la Public Suffix List
+from tailles import taille_requete, taille_reponse # octets réellement transférés (en-tetes, corps, _transferSize)
+from agregation import calcule_agregats, exporte_agregats # pour agréger les échanges par pays et par domaine
+from agregation_continue import AgregatsContinus # agrégation en mémoire bornée d'un flux d'entrées
+import table_echanges # pour ranger les échanges dans des colonnes typées
+from table_echanges import TableEchanges, infos_entree, exporte_echanges, vocabulaires_partages
+from profilage import profil # chronomètres d'étapes et compteurs d'appels (désactivés par défaut)
 
 
 
-# Initialisation des bases IP2Location
-baseIPV4 = IP2Location.IP2Location("IP2LOCATION-LITE-DB5.BIN")
-baseIPV6 = IP2Location.IP2Location("IP2LOCATION-LITE-DB5.IPV6.BIN")
+# Messages de diagnostic : le détail de chaque entrée est au niveau DEBUG, les bilans au niveau INFO
+logger = logging.getLogger("analyse_har")
+
+# Bases IP2Location : elles ne sont ouvertes qu'à leur première utilisation (voir get_base_ip2location)
+FICHIERS_IP2LOCATION = {4 : "IP2LOCATION-LITE-DB5.BIN", 6 : "IP2LOCATION-LITE-DB5.IPV6.BIN"}
+# "SHARED_MEMORY" : le fichier est projeté en mémoire en lecture seule (mmap), si bien que plusieurs processus partagent les mêmes pages du cache système
+# "FILE_IO" : lecture classique par seek/read
+MODE_IP2LOCATION = "SHARED_MEMORY"
+bases_ip2location = {} # version IP -> base ouverte dans le processus courant
+
+class BaseIP2Location(IP2Location.IP2Location):
+    '''
+    Base IP2Location dont le mode SHARED_MEMORY projette le fichier en lecture seule
+    (la bibliothèque l'ouvre en écriture, ce qui échoue sur une base en lecture seule, ex : fichier appartenant à root)
+    '''
+
+    def open(self, filename):
+        mode = self.mode
+        self.mode = "FILE_IO" # l'en-tete est lu par la bibliothèque, sans projection
+        try:
+            super().open(filename)
+        finally:
+            self.mode = mode
+        if mode == "SHARED_MEMORY":
+            with open(filename, 'rb') as f:
+                projection = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._f.close()
+            self._f = projection
+
+pid_bases_ip2location = None # processus qui a ouvert les bases de bases_ip2location
+
+def get_base_ip2location(version):
+    '''
+    Retourne la base IP2Location d'une famille d'adresses, en l'ouvrant à la première utilisation dans le processus courant
+    Après un fork, le processus fils rouvre ses propres bases (un fichier ouvert avant le fork partagerait sa position de lecture)
+    Parameters :
+        version (int) : 4 ou 6
+    Returns :
+        base (IP2Location) : la base
+    '''
+    global pid_bases_ip2location
+    if pid_bases_ip2location != os.getpid():
+        bases_ip2location.clear()
+        pid_bases_ip2location = os.getpid()
+    base = bases_ip2location.get(version)
+    if base is None:
+        base = BaseIP2Location(FICHIERS_IP2LOCATION[version], MODE_IP2LOCATION)
+        bases_ip2location[version] = base
+    return base
+
 ipTools = IP2Location.IP2LocationIPTools()
+# Nombre maximum d'adresses IP gardées dans le cache de géolocalisation (partagé entre tous les fichiers analysés)
+TAILLE_CACHE_IP = 65536
+# Nombre maximum de hostnames gardés dans le cache des domaines (TLD et domaine enregistrable)
+TAILLE_CACHE_DOMAINES = 65536
+# Index en mémoire des bases IP2Location (optionnel) : les fichiers BIN sont lus une seule fois dans des tableaux NumPy,
+# ce qui accélère fortement la géolocalisation quand il y a beaucoup d'adresses (par exemple pour ré-analyser des archives)
+UTILISER_INDEX_IP = False
+indexIP = IndexIP(FICHIERS_IP2LOCATION[4], FICHIERS_IP2LOCATION[6]) if UTILISER_INDEX_IP else None # plages chargées à la première recherche
+# Cache de géolocalisation sur disque (None pour le désactiver) : les adresses déjà géolocalisées lors des exécutions précédentes
+# ne sont pas recherchées dans les fichiers BIN. Il est vidé automatiquement quand les fichiers BIN sont mis à jour.
+CACHE_GEOLOC_DISQUE = "geoloc_cache.sqlite"
+cacheGeoloc = CacheGeoloc(CACHE_GEOLOC_DISQUE, FICHIERS_IP2LOCATION.values()) if CACHE_GEOLOC_DISQUE else None
+if cacheGeoloc is not None :
+    atexit.register(cacheGeoloc.ecrit)
+
+# Décodeur JSON des fichiers HAR (voir lecture_har.DECODEURS_POSSIBLES) : "auto" décode en entier les fichiers de moins de
+# lecture_har.TAILLE_MAX_DOCUMENT octets (orjson ou simdjson s'ils sont installés, la bibliothèque standard sinon),
+# et lit les plus gros de manière incrémentale (ijson, mémoire limitée à une entrée)
+DECODEUR_HAR = "auto"
+
+# Modes de sortie des résultats :
+#   "ecran" : graphes affichés dans une fenêtre (plt.show)
+#   "png"   : graphes enregistrés dans une image, sans interface graphique (backend Agg)
+#   "json" / "csv" : agrégats écrits dans un fichier, sans créer de graphe (matplotlib n'est pas importé)
+MODES_SORTIE = ("ecran", "png", "json", "csv")
+# Nom (sans extension) du fichier produit par les modes "png", "json" et "csv" quand aucun fichier n'est indiqué
+FICHIER_SORTIE_DEFAUT = "resultats"
+
+# Fonctions dont les appels sont comptés quand le profilage est activé (voir active_profilage)
+FONCTIONS_PROFILEES = ["EntreeHAR", "analyse_entry", "get_country_code", "get_country_codes", "get_IP2Loc_record", "lit_IP2Loc_record",
+                       "geolocalise_tables", "decoupe_hostnames", "get_tld_and_2nd_lvl_domain", "get_tld", "get_registrable_domain"]
+
+def active_profilage(memoire=False, fichier_cprofile=None):
+    '''
+    Active le profilage de l'analyse : durée de chaque étape, appels des fonctions de FONCTIONS_PROFILEES, et optionnellement
+    pic de mémoire par étape et profil cProfile. Le rapport est obtenu en fin d'exécution avec profil.termine().
+        Parameters :
+            memoire (bool) : si True, mesure le pic de mémoire de chaque étape (tracemalloc, ralentit l'exécution)
+            fichier_cprofile (string) : si renseigné, un profil cProfile est enregistré dans ce fichier
+    '''
+    if not profil.actif:
+        profil.instrumente(sys.modules[__name__], FONCTIONS_PROFILEES)
+    profil.active(memoire, fichier_cprofile)
 
 
 # vvvv Ne pas modifier vvvv:
-def process_data(my_data) : 
+def process_data(my_data, mode_sortie="ecran", fichier_sortie=None, fichier_echanges=None) : 
     '''
     Traite les données pour produire des résultats (valeurs et plots) à partir d'une liste 2D dans laquelle chaque ligne correspond aux attributs d'un échange réseau
         Parameters:
-            my_data : une liste 2D donc chaque ligne contient les attributs ['hostname','tld','domain','requestSize', 'responseSize', 'country'] d'un échange réseau
-    '''
-    # préparation du dataframe    
-    my_array = np.array(my_data)      
-    df = pd.DataFrame(my_array, columns = ['hostname','tld','domain','requestSize', 'responseSize', 'country'])
-    df=df.astype({'requestSize' : 'int64', 'responseSize' : 'int64'})
-    # Conversion des tailles de données en Ko (/1000)
-    df['requestSize']=df['requestSize'].div(1000)
-    df['responseSize']=df['responseSize'].div(1000)
+            my_data : une TableEchanges, ou une liste 2D donc chaque ligne contient les attributs ['hostname','tld','domain','requestSize', 'responseSize', 'country'] d'un échange réseau
+            mode_sortie (string) : un des MODES_SORTIE
+            fichier_sortie (string) : le fichier produit pour les modes "png", "json" et "csv" (voir sortie_resultats)
+            fichier_echanges (string) : si renseigné, la table des échanges est exportée dans ce fichier (.parquet ou .feather)
+    '''
+    # préparation du dataframe : les colonnes sont déjà typées (tailles en int64, chaines en catégories)
+    with profil.etape("construction_dataframe"):
+        if not isinstance(my_data, TableEchanges):
+            my_data = table_echanges.from_rows(my_data)
+        df = my_data.to_dataframe()
+    if fichier_echanges is not None:
+        with profil.etape("export_echanges"):
+            exporte_echanges(df, fichier_echanges, os.path.splitext(fichier_echanges)[1].lstrip('.'))
+    # Agrégation par pays et par domaine (un seul passage pour tous les graphes)
+    with profil.etape("agregations"):
+        agregats = calcule_agregats(df)
     
     print("="*20)
     # nb de domaines de second niveau contactés
-    nb_domain = len(pd.unique(df["domain"]))
+    nb_domain = agregats.nb_domain
     print(f"Nombre de domaine de second niveau : {nb_domain}")    
-    plot_data(df)
+    affiche_latences(agregats)
+    sortie_resultats(agregats, mode_sortie, fichier_sortie)
 
+def affiche_latences(agregats, nb=10):
+    '''
+    Affiche les domaines qui pèsent le plus sur le chargement des pages (temps sur le chemin critique avant onLoad)
+        Parameters:
+            agregats (Agregats) : les agrégats calculés par calcule_agregats
+            nb (int) : le nombre de domaines affichés
+    '''
+    latences = agregats.latences('domain').head(nb)
+    if len(latences) == 0 or not latences['critique'].any():
+        return # pas de pageTimings.onLoad dans le fichier
+    print("Domaines les plus longs sur le chemin critique avant onLoad (ms) :")
+    print(latences[['critique', 'wait', 'wait_p50', 'wait_p95', 'taux_reutilisation']].round(2).to_string())
 
-def plot_vol_sent_per_country(df,axes):
+def sortie_resultats(agregats, mode_sortie="ecran", fichier_sortie=None):
+    '''
+    Produit les résultats dans le mode de sortie demandé
+        Parameters:
+            agregats (Agregats) : les agrégats calculés par calcule_agregats
+            mode_sortie (string) : un des MODES_SORTIE
+            fichier_sortie (string) : le fichier produit pour les modes "png", "json" et "csv" (par défaut : FICHIER_SORTIE_DEFAUT.<mode>)
+    '''
+    if mode_sortie not in MODES_SORTIE:
+        raise ValueError(f"Mode de sortie inconnu : {mode_sortie} (modes possibles : {', '.join(MODES_SORTIE)})")
+    if fichier_sortie is None and mode_sortie != "ecran":
+        fichier_sortie = f"{FICHIER_SORTIE_DEFAUT}.{mode_sortie}"
+    with profil.etape("sortie_resultats"):
+        if mode_sortie in ("json", "csv"):
+            exporte_agregats(agregats, fichier_sortie, mode_sortie)
+        else:
+            plot_data(agregats, fichier_sortie if mode_sortie == "png" else None)
+
+
+# Les tailles sont agrégées en octets, elles sont converties en Ko (/1000) pour l'affichage
+def plot_vol_sent_per_country(agregats,axes):
     # Volume de données envoyé par pays
-    data = df.groupby("country")["requestSize"].sum().sort_values(ascending=True)
+    data = agregats.serie("country","requestSize").div(1000)
     plot_subplot(data,axes,"Volume (Ko)","Volume envoyé par pays")
     
-def plot_vol_recv_per_country(df,axes):
+def plot_vol_recv_per_country(agregats,axes):
     # Volume de données recues par pays
-    data = df.groupby("country")["responseSize"].sum().sort_values(ascending=True)
+    data = agregats.serie("country","responseSize").div(1000)
     plot_subplot(data,axes,"Volume (Ko)","Volume recu par pays")
     
-def plot_vol_sent_per_2nd_lvl_domain(df,axes):
+def plot_vol_sent_per_2nd_lvl_domain(agregats,axes):
      # Volume de données envoyé par domaine de 2nd niveau
-    data = df.groupby("domain")["requestSize"].sum().sort_values(ascending=True).tail(15)
+    data = agregats.serie("domain","requestSize").div(1000).tail(15)
     plot_subplot(data,axes,"Volume (Ko)","Volume envoyé par domaine de 2nd niveau")
 
-def plot_vol_recv_per_2nd_lvl_domain(df,axes):
+def plot_vol_recv_per_2nd_lvl_domain(agregats,axes):
      # Volume de données reçu par domaine de 2nd niveau
-    data = df.groupby("domain")["responseSize"].sum().sort_values(ascending=True).tail(15)
+    data = agregats.serie("domain","responseSize").div(1000).tail(15)
     plot_subplot(data,axes,"Volume (Ko)","Volume reçu par domaine de 2nd niveau")
     
 
-def plot_nb_exchange_per_country(df,axes):
+def plot_nb_exchange_per_country(agregats,axes):
     # Nombre d'échanges par pays
-    data = df.groupby("country")["country"].count().sort_values(ascending=True)
+    data = agregats.serie("country","count")
     plot_subplot(data,axes,"Nb. echanges","Nb. échanges par pays")
 
-def plot_nb_exchange_per_2nd_lvl_domain(df,axes):
+def plot_nb_exchange_per_2nd_lvl_domain(agregats,axes):
     # Nombre d'échanges par domaine de 2nd niveau
-    data = df.groupby("domain")["domain"].count().sort_values(ascending=True).tail(15)
+    data = agregats.serie("domain","count").tail(15)
     plot_subplot(data,axes,"Nb. echanges","Nb. échanges par domaine 2nd niv")
-def plot_nb_contact_per_2nd_lvl_domain(df,axes):
+def plot_nb_contact_per_2nd_lvl_domain(agregats,axes):
     # Nombre de domaines de 2nd niveau contactés
-    data = df["domain"].value_counts()
-    n = data.size
-    #print(data)
-    print(n)
+    n = agregats.nb_domain
+    logger.debug("Nombre de domaines de 2nd niveau contactés : %d", n)
     axes.axis('off')
     axes.text(0.1, 0.1, f'Nombre de domaines de 2nd niveau contactés : {n}', style='italic',   bbox={'facecolor': 'blue', 'alpha': 0.5, 'pad': 10})
     
@@ -102,34 +241,58 @@ def plot_subplot(data,axes,xlabel,title):
         y = p.get_y() + p.get_height()/2 -0.1
         axes.annotate(percentage, (x, y), fontsize = 6)
     
-def plot_data(df) :
+def get_pyplot(backend=None):
     '''
-    Génère les graphes de résultats à partir d'un dataframe 2D dans laquelle chaque ligne correspond aux attributs d'un échange réseau
+    Importe matplotlib.pyplot seulement au moment où un graphe est demandé (import couteux, inutile pour les sorties json/csv)
         Parameters:
-            df : un dataframe 2D donc chaque ligne contient les attributs ['hostname','tld','domain','requestSize', 'responseSize', 'country'] d'un échange réseau
+            backend (string) : le backend matplotlib à utiliser (ex : "Agg" pour produire des images sans interface graphique)
+        Returns:
+            plt : le module matplotlib.pyplot
     '''
-    # préparation des plots
-    fig, axes = plt.subplots(nrows=4, ncols=2, constrained_layout = True)
-    # Volume de données envoyé par pays
-    plot_vol_sent_per_country(df,axes[0,0])
-    # Volume de données recues par pays
-    plot_vol_recv_per_country(df,axes[0,1])
-    # Volume de données envoyé par domaine de 2nd niveau
-    plot_vol_sent_per_2nd_lvl_domain(df,axes[1,0])
-    # Volume de données recues par domaine de 2nd niveau
-    plot_vol_recv_per_2nd_lvl_domain(df,axes[1,1])
-    # Nombre d'échanges par pays
-    plot_nb_exchange_per_country(df,axes[2,0])
-    # Nombre d'échanges par domaine de 2nd niveau
-    plot_nb_exchange_per_2nd_lvl_domain(df,axes[2,1])
-    # Desactivation des axes de la 4eme ligne pour faire de la place pour le texte  
-    axes[3,0].axis('off')    
-    axes[3,1].axis('off')
-    # Nombre de domaines tiers / serveur contactés
-    plot_nb_contact_per_2nd_lvl_domain(df,axes[3,0])
+    import matplotlib
+    if backend is not None:
+        matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+    return plt
+
+def plot_data(agregats, fichier_png=None) :
+    '''
+    Génère les graphes de résultats à partir des agrégats par pays et par domaine des échanges réseau
+        Parameters:
+            agregats (Agregats) : les agrégats calculés par calcule_agregats
+            fichier_png (string) : si renseigné, les graphes sont enregistrés dans ce fichier (backend Agg) au lieu d'être affichés
+    '''
+    with profil.etape("graphes"):
+        plt = get_pyplot("Agg" if fichier_png is not None else None)
+        # préparation des plots
+        fig, axes = plt.subplots(nrows=4, ncols=2, constrained_layout = True)
+        # Volume de données envoyé par pays
+        plot_vol_sent_per_country(agregats,axes[0,0])
+        # Volume de données recues par pays
+        plot_vol_recv_per_country(agregats,axes[0,1])
+        # Volume de données envoyé par domaine de 2nd niveau
+        plot_vol_sent_per_2nd_lvl_domain(agregats,axes[1,0])
+        # Volume de données recues par domaine de 2nd niveau
+        plot_vol_recv_per_2nd_lvl_domain(agregats,axes[1,1])
+        # Nombre d'échanges par pays
+        plot_nb_exchange_per_country(agregats,axes[2,0])
+        # Nombre d'échanges par domaine de 2nd niveau
+        plot_nb_exchange_per_2nd_lvl_domain(agregats,axes[2,1])
+        # Desactivation des axes de la 4eme ligne pour faire de la place pour le texte  
+        axes[3,0].axis('off')    
+        axes[3,1].axis('off')
+        # Nombre de domaines tiers / serveur contactés
+        plot_nb_contact_per_2nd_lvl_domain(agregats,axes[3,0])
     
     
-    plt.show()
+    # Le calcul de la mise en page (constrained_layout) a lieu au dessin de la figure
+    # (en mode écran, la durée de cette étape inclut le temps d'affichage de la fenêtre)
+    with profil.etape("dessin"):
+        if fichier_png is None:
+            plt.show()
+        else:
+            fig.savefig(fichier_png)
+            plt.close(fig)
 
 
 # Fonctions provenant de l'exercice préliminaire 
@@ -154,9 +317,53 @@ def get_2nd_lvl_domain(hostname):
     Returns :
         domain_2 (string) : le domaine de second niveau
     '''
-    tld = get_tld(hostname)
-    domain_2 = hostname.split('.')[-2] + "." + tld
+    labels = hostname.split('.')
+    domain_2 = labels[-2] + "." + labels[-1]
     return domain_2
+
+@lru_cache(maxsize=TAILLE_CACHE_DOMAINES)
+def get_tld_and_2nd_lvl_domain(hostname):
+    '''
+    Retourne le TLD et le domaine enregistrable d'un hostname (résultat mis en cache par hostname)
+    Le domaine tient compte de la Public Suffix List : www.sydney.edu.au donne sydney.edu.au (et non edu.au comme get_2nd_lvl_domain)
+    Parameters :
+        hostname (string) : le hostname, avec éventuellement un port (valeur de l'en-tete Host)
+    Returns :
+        (tld, domain_2) : le TLD et le domaine enregistrable (sans le port)
+    '''
+    nom = retire_port(hostname)
+    return get_tld(nom), get_registrable_domain(nom)
+
+def get_tld_and_2nd_lvl_domain_columns(hostnames):
+    '''
+    Calcule le TLD et le domaine enregistrable de chaque hostname distinct d'une colonne, une seule fois par hostname
+    (les colonnes tld et domain d'une TableEchanges sont ensuite obtenues par remplace_valeurs, sans parcourir les lignes)
+    Parameters :
+        hostnames : les valeurs distinctes de la colonne hostname (ex : le vocabulaire de la colonne)
+    Returns :
+        (tlds, domains_2) : deux dictionnaires hostname -> TLD et hostname -> domaine enregistrable
+    '''
+    tlds = {}
+    domains_2 = {}
+    for hostname in hostnames:
+        tlds[hostname], domains_2[hostname] = get_tld_and_2nd_lvl_domain(hostname)
+    return tlds, domains_2
+
+def decoupe_hostnames(tables):
+    '''
+    Remplit les colonnes tld et domain de tables analysées avec decoupe=False (voir analyse_entry), qui contiennent encore le hostname
+    Parameters :
+        tables : les TableEchanges (par exemple celles des pages d'un même fichier)
+    '''
+    tables = list(tables)
+    hostnames = set()
+    for my_data in tables:
+        hostnames.update(my_data.colonnes['tld'].vocabulaire.valeurs)
+    tlds, domains_2 = get_tld_and_2nd_lvl_domain_columns(hostnames)
+    for my_data in tables:
+        my_data.colonnes['tld'].remplace_valeurs(tlds)
+        my_data.colonnes['domain'].remplace_valeurs(domains_2)
+
     
 
 def affiche_type_adresse(ip):
@@ -170,9 +377,26 @@ def affiche_type_adresse(ip):
     else :
         print("IPV6")
 
+@lru_cache(maxsize=TAILLE_CACHE_IP)
 def get_IP2Loc_record(ip):
     '''
-    Récupère l'enregristrement IP2Location correspondant à une adresse IP
+    Récupère l'enregristrement IP2Location correspondant à une adresse IP, en passant par le cache disque s'il est activé
+    Parameters :
+        ip (string) : l'adresse IP
+    Returns : 
+        rec (record) : l'enregistrement 
+    '''
+    if cacheGeoloc is None :
+        return lit_IP2Loc_record(ip)
+    rec = cacheGeoloc.get(ip)
+    if rec is None :
+        rec = lit_IP2Loc_record(ip)
+        cacheGeoloc.ajoute(ip, rec)
+    return rec
+
+def lit_IP2Loc_record(ip):
+    '''
+    Lit dans les bases IP2Location l'enregristrement correspondant à une adresse IP
     Parameters :
         ip (string) : l'adresse IP
     Returns : 
@@ -183,9 +407,9 @@ def get_IP2Loc_record(ip):
 
     # Il faut distinguer les cas en fonction du type d'adresse IP (v4 ou v6) (en utilisant ipTools)
     if ipTools.is_ipv4(ip) : 
-        rec = baseIPV4.get_all(ip) # Si l'adresse est en IPV4 on récupère l'enregistrement via la baseIPV4 en utilisant la fonction getall() 
+        rec = get_base_ip2location(4).get_all(ip) # Si l'adresse est en IPV4 on récupère l'enregistrement via la base IPV4 en utilisant la fonction getall() 
     else :
-        rec = baseIPV6.get_all(ip) # Sinon (l'adresse est en IPV6) on récupère l'enregistrement sur la baseIPV6
+        rec = get_base_ip2location(6).get_all(ip) # Sinon (l'adresse est en IPV6) on récupère l'enregistrement sur la base IPV6
     return rec
 
 def get_country_code(ip):
@@ -196,24 +420,128 @@ def get_country_code(ip):
     Returns : 
         country_code : le code pays
     '''
+    if indexIP is not None :
+        return get_country_code_index(ip)
     rec = get_IP2Loc_record(ip)    
     return rec.country_short
-    
+
+@lru_cache(maxsize=TAILLE_CACHE_IP)
+def get_country_code_index(ip):
+    '''
+    Retourne le code pays d'une adresse IP d'après l'index en mémoire (une adresse à la fois : pour plusieurs adresses, get_country_codes
+    fait une seule recherche vectorisée)
+    Parameters :
+        ip (string) : l'adresse IP
+    Returns : 
+        country_code : le code pays
+    '''
+    return indexIP.get_country_code(ip)
+
+def get_country_codes(ips):
+    '''
+    Retourne les codes pays d'un ensemble d'adresses IP, chaque adresse distincte n'étant géolocalisée qu'une seule fois
+    Parameters :
+        ips : un itérable d'adresses IP (les doublons sont autorisés)
+    Returns : 
+        country_codes (dict) : un dictionnaire adresse IP -> code pays
+    '''
+    ips = list(set(ips))
+    if indexIP is not None :
+        # Recherche vectorisée de toutes les adresses d'un coup
+        stats_lots_ip["lots"] += 1
+        stats_lots_ip["adresses_lots"] += len(ips)
+        return dict(zip(ips, indexIP.get_country_codes(ips)))
+    return {ip : get_country_code(ip) for ip in ips}
+
+def ecrit_cache_geoloc():
+    '''
+    Ecrit sur le disque les nouvelles entrées du cache de géolocalisation (appelé après chaque fichier analysé)
+    '''
+    if cacheGeoloc is not None :
+        cacheGeoloc.ecrit()
+
+def vide_caches():
+    '''
+    Vide les caches en mémoire du processus (géolocalisation et domaines), par exemple pour mesurer une analyse sans cache chaud
+    '''
+    get_IP2Loc_record.cache_clear()
+    get_country_code_index.cache_clear()
+    get_tld_and_2nd_lvl_domain.cache_clear()
+    stats_lots_ip.update(lots=0, adresses_lots=0)
+
+# Recherches vectorisées faites par get_country_codes avec l'index en mémoire (elles ne passent pas par le cache IP)
+stats_lots_ip = {"lots" : 0, "adresses_lots" : 0}
+
+def stats_cache_ip():
+    '''
+    Retourne l'efficacité du cache de géolocalisation utilisé par le processus courant : celui de get_country_code_index avec l'index
+    en mémoire, celui de get_IP2Loc_record sinon
+        Returns :
+            stats (dict) : pid, cache (nom de la fonction), succes, echecs, adresses (en cache), taille_max, lots et adresses_lots
+                (recherches vectorisées) ; transmissible d'un processus à l'autre (voir cumule_stats_cache_ip)
+    '''
+    fonction = get_country_code_index if indexIP is not None else get_IP2Loc_record
+    info = fonction.cache_info()
+    return {"pid" : os.getpid(), "cache" : fonction.__name__, "succes" : info.hits, "echecs" : info.misses,
+            "adresses" : info.currsize, "taille_max" : info.maxsize, **stats_lots_ip}
+
+def plus_recentes(stats, autres):
+    '''
+    Retourne les plus récentes de deux statistiques d'un même processus (ses compteurs ne font que croitre) ; stats peut valoir None
+    '''
+    if stats is None or autres["succes"] + autres["echecs"] + autres["lots"] >= stats["succes"] + stats["echecs"] + stats["lots"]:
+        return autres
+    return stats
+
+def cumule_stats_cache_ip(liste_stats):
+    '''
+    Additionne les statistiques du cache de géolocalisation de plusieurs processus (la plus récente de chaque processus)
+        Parameters :
+            liste_stats : un itérable de statistiques obtenues avec stats_cache_ip, dans n'importe quel ordre
+        Returns :
+            stats (dict) : les statistiques cumulées (mêmes clés, sans pid), ou None si la liste est vide
+    '''
+    dernieres = {}
+    for stats in liste_stats:
+        dernieres[stats["pid"]] = plus_recentes(dernieres.get(stats["pid"]), stats)
+    if not dernieres:
+        return None
+    total = {"cache" : next(iter(dernieres.values()))["cache"]}
+    for cle in ("succes", "echecs", "adresses", "taille_max", "lots", "adresses_lots"):
+        total[cle] = sum(stats[cle] for stats in dernieres.values())
+    return total
+
+def affiche_stats_cache_ip(stats=None):
+    '''
+    Affiche (niveau INFO) l'efficacité du cache de géolocalisation (nombre de succès et d'échecs, et recherches vectorisées)
+        Parameters :
+            stats (dict) : les statistiques à afficher (voir stats_cache_ip et cumule_stats_cache_ip), par défaut celles du processus courant
+    '''
+    if stats is None:
+        stats = stats_cache_ip()
+    total = stats["succes"] + stats["echecs"]
+    taux = 100 * stats["succes"] / total if total else 0
+    logger.info("Cache IP (%s) : %d succès, %d échecs (%.1f%% de succès), %d/%d adresses", stats["cache"], stats["succes"], stats["echecs"],
+                taux, stats["adresses"], stats["taille_max"])
+    if stats["lots"]:
+        logger.info("Index IP : %d adresses distinctes géolocalisées en %d recherches vectorisées", stats["adresses_lots"], stats["lots"])
 
     
 
 # Analyse d'une entrée
         
-def analyse_entry(entry):
+def analyse_entry(entry, geolocalise=True, decoupe=True):
     '''
     Analyse une entrée HAR et retourne une liste contenant des informations sur cet échange
         Parameters :
-            entry : (HARentry) une entrée HAR correspondant à un échange réseau
+            entry : (EntreeHAR ou haralyzer.HarEntry) une entrée HAR correspondant à un échange réseau
+            geolocalise (bool) : si False, l'adresse IP du serveur est retournée à la place du code pays
+                (géolocalisation faite ensuite par lots, voir get_country_codes)
+            decoupe (bool) : si False, le hostname est retourné à la place du TLD et du domaine
+                (calculés ensuite une fois par hostname distinct, voir decoupe_hostnames)
         Returns : 
             res : une liste contenant des informations sur la page :  hostname, tld, domain_2, requestSize, responseSize, country, ou None si il y a un problème avec l'entrée
     '''
-    print("=============================")
-    
     # Liste des variables à renseigner
     hostname = ""
     tld = "" # Top Level Domain
@@ -233,40 +561,191 @@ def analyse_entry(entry):
     # TODO Q4.2 : récupérer / calculer la valeurs des variables précédentes
     # Hostname
     hostname = entry.request.host
-    print(f"hostname = {hostname}")
+    logger.debug("hostname = %s", hostname)
     
     # TODO Q4.3 
     # TLD et domain_2
-    tld = get_tld(hostname)
-    print(f"TLD = {tld}")
-    domain_2 = get_2nd_lvl_domain(hostname)
-    print(f"domain de second niveau = {domain_2}")
+    tld, domain_2 = get_tld_and_2nd_lvl_domain(hostname) if decoupe else (hostname, hostname) # un seul découpage par hostname distinct
+    logger.debug("TLD = %s, domain de second niveau = %s", tld, domain_2)
     
     # TODO Q4.4 
-    # requestSize et responseSize
-    requestSize = entry.request.bodySize
-    responseSize = entry.response.bodySize
+    # requestSize et responseSize : octets transférés, en-tetes compris (bodySize seul vaut souvent 0 ou -1, voir tailles)
+    requestSize = taille_requete(entry.raw_entry)
+    responseSize = taille_reponse(entry.raw_entry)
     
     # TODO Q4.5 
     # country code
-    country = get_country_code(ip_server)
+    country = get_country_code(ip_server) if geolocalise else ip_server
     
     # Les résultats sont rangés dans une liste avant d'être retournés
     res = [hostname, tld, domain_2, requestSize, responseSize, country]
     return res    
 
 
-# TODO : renseigner le nom du fichier du journal HAR a ouvrir
-har_file_name = "har_data.har"
-with open(har_file_name, 'r', encoding="utf-8") as f:
-    har_page = HarPage('page_3', har_data=json.loads(f.read())) # en cas d'erreur avec le page_id, modifier en "page_1"
+def analyse_entrees(har_file_name, range_echange, page_id=None, pages=None, decodeur=None, geolocalise=True, decoupe=True):
+    '''
+    Lit et analyse les entrées d'un fichier HAR une par une (boucle commune à toutes les analyses d'un fichier)
+        Parameters :
+            har_file_name : le chemin du fichier HAR, son contenu déjà lu (bytes) ou un fichier ouvert (voir lecture_har.iter_entries)
+            range_echange : fonction appelée avec (res, entry) pour chaque échange analysé : res est le résultat de analyse_entry
+                et entry l'entrée HAR (dict), par exemple pour ranger l'échange dans une TableEchanges ou dans des agrégats
+            page_id (string) : l'identifiant de la page à analyser, ou None pour analyser toutes les entrées
+            pages (dict) : si renseigné, complété par les pages du fichier (voir lecture_har.iter_entries)
+            decodeur (string) : le décodeur JSON (voir lecture_har.DECODEURS_POSSIBLES), par défaut DECODEUR_HAR
+            geolocalise, decoupe (bool) : voir analyse_entry (si False, voir geolocalise_tables et decoupe_hostnames)
+        Returns :
+            nb_analysees (int) : le nombre d'échanges analysés
+            nb_ignorees (int) : le nombre d'entrées ignorées (sans adresse de serveur)
+    '''
+    nb_analysees = nb_ignorees = 0
+    # La lecture est chronométrée entrée par entrée, à l'intérieur de l'étape lecture_et_analyse
+    # (en lecture incrémentale, le fichier n'est jamais chargé entièrement en mémoire)
+    with profil.etape("lecture_et_analyse"):
+        for e in profil.itere("lecture_json", iter_entries(har_file_name, page_id, decodeur or DECODEUR_HAR, pages)):
+            a = analyse_entry(EntreeHAR(e), geolocalise=geolocalise, decoupe=decoupe)
+            logger.debug("%s", a)
+            if a != None : # on ignore les None (problème identifié avec l'entrée)
+                range_echange(a, e)
+                nb_analysees += 1
+            else :
+                nb_ignorees += 1
+    return nb_analysees, nb_ignorees
 
+def geolocalise_tables(tables, country_codes=None):
+    '''
+    Remplace les adresses IP de la colonne country de tables analysées avec geolocalise=False (voir analyse_entry) par leur code pays
+        Parameters :
+            tables : les TableEchanges (par exemple celles des pages d'un même fichier)
+            country_codes (dict) : adresse IP -> code pays déjà calculé (ex : par le thread de géolocalisation du pipeline), ou None
+                pour géolocaliser en un seul lot les adresses distinctes des tables (voir get_country_codes)
+    '''
+    tables = list(tables)
+    if country_codes is None:
+        ips = set()
+        for my_data in tables:
+            ips.update(my_data.colonnes['country'].vocabulaire.valeurs)
+        country_codes = get_country_codes(ips)
+    for my_data in tables:
+        my_data.colonnes['country'].remplace_valeurs(country_codes)
 
-my_data = []
-for e in har_page.entries:
-    a = analyse_entry(e)
-    print(a)
-    if a != None : # on ignore les None (problème identifié avec l'entrée)
-        my_data += [a]
-process_data(my_data)
+def analyse_har_file(har_file_name, page_id=None):
+    '''
+    Analyse toutes les entrées d'un fichier HAR (ou d'une de ses pages)
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR
+            page_id (string) : l'identifiant de la page à analyser, ou None pour analyser toutes les entrées
+        Returns :
+            my_data (TableEchanges) : la table des échanges analysés
+    '''
+    my_data = TableEchanges()
+    pages = {} # pages du fichier (début et onLoad), complétées pendant la lecture des entrées
+    par_lots = indexIP is not None # avec l'index, les adresses distinctes du fichier sont géolocalisées en une seule recherche vectorisée
+    nb_analysees, nb_ignorees = analyse_entrees(har_file_name, lambda a, e: my_data.ajoute(a + infos_entree(e)), page_id, pages,
+                                                geolocalise=not par_lots, decoupe=False)
+    decoupe_hostnames([my_data])
+    if par_lots:
+        geolocalise_tables([my_data])
+    my_data.ajoute_pages(pages)
+    ecrit_cache_geoloc()
+    affiche_bilan_entrees(har_file_name, nb_analysees, nb_ignorees)
+    return my_data
+
+def analyse_har_file_par_page(har_file_name):
+    '''
+    Analyse toutes les pages d'un fichier HAR en un seul parcours des entrées, en les regroupant selon leur pageref
+    (au lieu de construire un HarPage par page, qui reparcourt toutes les entrées à chaque fois)
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR
+        Returns :
+            pages (dict) : page_id -> TableEchanges des échanges de cette page ("unknown" pour les entrées sans pageref)
+    '''
+    pages = {}
+    infos_pages = {} # pages du fichier (début et onLoad), complétées pendant la lecture des entrées
+    vocabulaires = vocabulaires_partages() # un hostname présent sur plusieurs pages n'est stocké qu'une fois
+    par_lots = indexIP is not None # voir analyse_har_file
+    def range_dans_sa_page(a, e):
+        page = e.get("pageref", "unknown")
+        if page not in pages:
+            pages[page] = TableEchanges(vocabulaires)
+        pages[page].ajoute(a + infos_entree(e))
+    nb_analysees, nb_ignorees = analyse_entrees(har_file_name, range_dans_sa_page, pages=infos_pages, geolocalise=not par_lots, decoupe=False)
+    decoupe_hostnames(pages.values())
+    if par_lots:
+        geolocalise_tables(pages.values()) # adresses de toutes les pages du fichier, géolocalisées en un seul lot
+    for my_data in pages.values():
+        my_data.ajoute_pages(infos_pages)
+    ecrit_cache_geoloc()
+    affiche_bilan_entrees(har_file_name, nb_analysees, nb_ignorees)
+    return pages
+
+def analyse_har_file_en_continu(har_file_name, page_id=None, agregats=None):
+    '''
+    Analyse les entrées d'un fichier HAR en mettant à jour des agrégats continus à chaque entrée, sans construire la table des échanges
+    La lecture est incrémentale (ijson) : la mémoire utilisée ne dépend pas du nombre d'entrées (agrégats de taille fixe,
+    caches des adresses IP et des domaines limités à TAILLE_CACHE_IP et TAILLE_CACHE_DOMAINES éléments)
+        Parameters :
+            har_file_name : le chemin du fichier HAR, son contenu ou un fichier ouvert (ex : un flux de capture)
+            page_id (string) : l'identifiant de la page à analyser, ou None pour analyser toutes les entrées
+            agregats (AgregatsContinus) : des agrégats à compléter (ex : ceux des fichiers précédents d'une capture), ou None
+        Returns :
+            agregats (AgregatsContinus) : les agrégats mis à jour
+    '''
+    if agregats is None:
+        agregats = AgregatsContinus()
+    nb_analysees, nb_ignorees = analyse_entrees(har_file_name, lambda a, e: agregats.ajoute(a), page_id, decodeur="ijson")
+    ecrit_cache_geoloc()
+    affiche_bilan_entrees(har_file_name, nb_analysees, nb_ignorees)
+    return agregats
+
+def affiche_bilan_entrees(har_file_name, nb_analysees, nb_ignorees):
+    '''
+    Affiche (niveau INFO) le bilan de l'analyse d'un fichier : nombre d'entrées analysées et d'entrées ignorées
+    (entrées sans serverIPAddress, par exemple les requetes bloquées)
+    '''
+    if isinstance(har_file_name, (bytes, bytearray, memoryview)):
+        har_file_name = f"<contenu de {len(har_file_name)} octets>"
+    elif not isinstance(har_file_name, str):
+        har_file_name = getattr(har_file_name, "name", "<flux>") # fichier ouvert
+    logger.info("%s : %d entrées analysées, %d entrées ignorées (sans adresse de serveur)", har_file_name, nb_analysees, nb_ignorees)
+
+
+if __name__ == "__main__":
+    # TODO : renseigner le nom du fichier du journal HAR a ouvrir
+    har_file_name = "har_data.har"
+    page_id = 'page_3' # en cas d'erreur avec le page_id, modifier en "page_1", ou None pour analyser toutes les pages
+    mode_sortie = "ecran" # voir MODES_SORTIE ("png", "json" ou "csv" pour les traitements par lots)
+    fichier_sortie = FICHIER_SORTIE_DEFAUT # nom du fichier produit, sans extension
+    fichier_echanges = None # table des échanges à exporter en colonnes, ex : "echanges.parquet" (ou .feather)
+    niveau_log = logging.INFO # logging.DEBUG pour afficher le détail de chaque entrée, logging.WARNING pour un mode silencieux
+    profilage = False # True pour afficher en fin d'exécution la durée de chaque étape et le nombre d'appels des fonctions de FONCTIONS_PROFILEES
+    profilage_memoire = False # True pour mesurer aussi le pic de mémoire de chaque étape (plus lent)
+    fichier_cprofile = None # profil cProfile complet à enregistrer, ex : "analyse.prof"
+    agregation_continue = False # True pour agréger les entrées au fil de la lecture, en mémoire bornée (volumes et nombres d'échanges seulement)
+
+    logging.basicConfig(level=niveau_log, format="%(message)s")
+    if profilage :
+        active_profilage(profilage_memoire, fichier_cprofile)
+
+    if agregation_continue :
+        agregats = analyse_har_file_en_continu(har_file_name, page_id)
+        affiche_stats_cache_ip()
+        print("="*20)
+        print(f"Nombre de domaine de second niveau (estimation) : {agregats.nb_domain}")
+        sortie_resultats(agregats, mode_sortie, f"{fichier_sortie}.{mode_sortie}")
+    elif page_id is None :
+        pages = analyse_har_file_par_page(har_file_name)
+        affiche_stats_cache_ip()
+        for page, my_data in pages.items():
+            print(f"===== Page HAR : {page} =====")
+            echanges_page = None
+            if fichier_echanges is not None :
+                racine, extension = os.path.splitext(fichier_echanges)
+                echanges_page = f"{racine}_{page}{extension}"
+            process_data(my_data, mode_sortie, f"{fichier_sortie}_{page}.{mode_sortie}", echanges_page)
+    else :
+        my_data = analyse_har_file(har_file_name, page_id)
+        affiche_stats_cache_ip()
+        process_data(my_data, mode_sortie, f"{fichier_sortie}.{mode_sortie}", fichier_echanges)
 
+    if profil.actif :
+        print(profil.termine())
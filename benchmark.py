@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mesure des performances de l'analyse sur des fichiers HAR synthétiques
+
+Génère (sans accès réseau) :
+    - des fichiers HAR de même structure que example.har, avec quelques centaines de hostnames répartis selon une loi de Zipf
+      (quelques serveurs très sollicités, beaucoup de serveurs rares) et quelques entrées bloquées (sans serverIPAddress)
+    - une petite base IP2Location au format DB5 (fichiers BIN IPV4 et IPV6)
+puis chronomètre séparément chaque étape : lecture du JSON, boucle analyse_entry, construction du DataFrame (process_data),
+agrégations par pays et par domaine, rendu des graphes. Les résultats sont enregistrés en JSON pour comparer les exécutions.
+
+Utilisation : python benchmark.py [--tailles 1000 100000 1000000] [--repertoire bench_data] [-o bench_resultats.json] [--decodeur auto|ijson|orjson|simdjson|json] [--sans-rendu]
+"""
+
+import argparse # pour les arguments de la ligne de commande
+import base64 # pour les corps de réponse synthétiques
+import datetime # pour les dates des entrées
+import json # pour écrire les fichiers HAR et les résultats
+import logging # pour désactiver les messages de l'analyse pendant les mesures
+import os # pour les chemins
+import platform # pour décrire la machine dans les résultats
+import random # pour les données synthétiques
+import struct # pour écrire les fichiers BIN
+import time # pour chronométrer les étapes
+
+import analyse_fichier_HAR as analyse # fonctions d'analyse
+from agregation import calcule_agregats # agrégations par pays et par domaine
+from lecture_har import DECODEURS_POSSIBLES, choisit_decodeur, iter_entries # lecture des fichiers HAR
+
+
+# Le fichier de 1 million d'entrées occupe environ 2,5 Go : il est généré une seule fois, puis réutilisé (voir --repertoire)
+TAILLES_DEFAUT = [1000, 100000, 1000000]
+PAYS = [("US", "United States of America"), ("FR", "France"), ("DE", "Germany"), ("IE", "Ireland"), ("NL", "Netherlands"),
+        ("GB", "United Kingdom of Great Britain and Northern Ireland"), ("AU", "Australia"), ("JP", "Japan"), ("-", "-")]
+SUFFIXES = ["com", "net", "org", "fr", "de", "co.uk", "com.au", "io", "edu.au"]
+NB_DOMAINES = 80
+NB_HOSTNAMES = 300
+TAUX_BLOQUEES = 0.03 # proportion d'entrées sans serverIPAddress
+
+
+def genere_base_ip2location(chemin, nb_plages_v4, nb_plages_v6, graine=0):
+    '''
+    Ecrit une base IP2Location synthétique au format BIN DB5 (pays, région, ville, latitude, longitude)
+        Parameters :
+            chemin (string) : le fichier BIN à écrire
+            nb_plages_v4 (int) : le nombre de plages d'adresses IPV4
+            nb_plages_v6 (int) : le nombre de plages d'adresses IPV6
+            graine (int) : la graine du générateur aléatoire
+    '''
+    rnd = random.Random(graine)
+    nb_colonnes = 6 # début de plage, pays, région, ville, latitude, longitude
+    taille_entete = 64
+    largeur_v4 = nb_colonnes * 4
+    largeur_v6 = nb_colonnes * 4 + 12
+    debuts_v4 = sorted(set([0] + rnd.sample(range(1, 2**32 - 1), nb_plages_v4 - 1)))
+    debuts_v6 = sorted(set([0] + [rnd.getrandbits(128) for _ in range(nb_plages_v6 - 1)]))
+    # Les positions dans les fichiers BIN commencent à 1 ; chaque famille a une ligne de fin (fin de la dernière plage)
+    adresse_v4 = taille_entete + 1
+    adresse_v6 = adresse_v4 + (len(debuts_v4) + 1) * largeur_v4
+    debut_chaines = adresse_v6 - 1 + (len(debuts_v6) + 1) * largeur_v6
+
+    chaines = bytearray()
+    pointeurs_pays = []
+    for court, long in PAYS:
+        pointeurs_pays.append(debut_chaines + len(chaines))
+        chaines += bytes([len(court)]) + court.encode() + bytes([len(long)]) + long.encode()
+    pointeur_tiret = debut_chaines + len(chaines)
+    chaines += b'\x01-'
+
+    donnees = bytearray(struct.pack('<BBBBBIIIIII', 5, nb_colonnes, 22, 12, 1, len(debuts_v4), adresse_v4,
+                                    len(debuts_v6), adresse_v6, 0, 0))
+    donnees += bytes([1]) # code produit IP2Location
+    donnees += bytes(taille_entete - len(donnees))
+    for debut in debuts_v4 + [2**32 - 1]:
+        pays = rnd.choice(pointeurs_pays)
+        donnees += struct.pack('<IIIIff', debut, pays, pointeur_tiret, pointeur_tiret, 0.0, 0.0)
+    for debut in debuts_v6 + [2**128 - 1]:
+        pays = rnd.choice(pointeurs_pays)
+        donnees += struct.pack('<IIII', *[(debut >> (32 * k)) & 0xffffffff for k in range(4)])
+        donnees += struct.pack('<IIIff', pays, pointeur_tiret, pointeur_tiret, 0.0, 0.0)
+    donnees += chaines
+    with open(chemin, 'wb') as f:
+        f.write(donnees)
+
+
+def genere_serveurs(rnd):
+    '''
+    Tire les hostnames du HAR synthétique et leurs adresses IP (1 à 3 par hostname, IPV4 ou IPV6)
+        Parameters :
+            rnd (random.Random) : le générateur aléatoire
+        Returns :
+            serveurs (list) : liste de couples (hostname, liste d'adresses IP)
+            poids (list) : poids de tirage de chaque serveur (loi de Zipf)
+    '''
+    domaines = [f"site{i}.{rnd.choice(SUFFIXES)}" for i in range(NB_DOMAINES)]
+    prefixes = ["www", "cdn", "static", "img", "api", "tracker", "ads", "fonts", "s1", "media"]
+    hostnames = set()
+    while len(hostnames) < NB_HOSTNAMES:
+        hostnames.add(f"{rnd.choice(prefixes)}{rnd.randint(0, 9)}.{rnd.choice(domaines)}")
+    serveurs = []
+    for hostname in sorted(hostnames):
+        ips = []
+        for _ in range(rnd.randint(1, 3)):
+            if rnd.random() < 0.7:
+                ips.append(".".join(str(rnd.randint(1, 254)) for _ in range(4)))
+            else:
+                ips.append(":".join(f"{rnd.getrandbits(16):x}" for _ in range(8)))
+        serveurs.append((hostname, ips))
+    rnd.shuffle(serveurs)
+    poids = [1 / (rang + 1) for rang in range(len(serveurs))]
+    return serveurs, poids
+
+
+def genere_entree(rnd, hostname, ip, date):
+    '''
+    Construit une entrée HAR synthétique (même structure que les entrées de example.har)
+    '''
+    taille_reponse = rnd.choice([0, 43, 512, 1256, 4096, 25000, 150000])
+    corps = base64.b64encode(rnd.randbytes(min(taille_reponse, 2048))).decode()
+    attente = rnd.randint(5, 300)
+    entree = {
+        "pageref" : "page_1",
+        "startedDateTime" : date.isoformat(timespec='milliseconds'),
+        "request" : {
+            "bodySize" : rnd.choice([0, 0, 0, 120, 800]),
+            "method" : "GET",
+            "url" : f"https://{hostname}/ressource/{rnd.getrandbits(32):x}",
+            "httpVersion" : "HTTP/2",
+            "headers" : [
+                {"name" : "Host", "value" : hostname},
+                {"name" : "User-Agent", "value" : "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:107.0) Gecko/20100101 Firefox/107.0"},
+                {"name" : "Accept", "value" : "*/*"},
+            ],
+            "cookies" : [],
+            "queryString" : [],
+            "headersSize" : rnd.randint(300, 700),
+        },
+        "response" : {
+            "status" : 200,
+            "statusText" : "OK",
+            "httpVersion" : "HTTP/2",
+            "headers" : [{"name" : "Content-Type", "value" : "application/octet-stream"}],
+            "cookies" : [],
+            "content" : {"mimeType" : "application/octet-stream", "size" : taille_reponse, "encoding" : "base64", "text" : corps},
+            "redirectURL" : "",
+            "headersSize" : rnd.randint(200, 500),
+            "bodySize" : taille_reponse,
+        },
+        "cache" : {},
+        "timings" : {"blocked" : 0, "dns" : rnd.choice([-1, 0, 12]), "connect" : rnd.choice([-1, 0, 25]), "ssl" : -1,
+                     "send" : 0, "wait" : attente, "receive" : rnd.randint(0, 50)},
+        "time" : attente,
+        "serverIPAddress" : ip,
+        "connection" : "443",
+    }
+    if rnd.random() < TAUX_BLOQUEES:
+        del entree["serverIPAddress"]
+    return entree
+
+
+def genere_har(chemin, nb_entrees, graine=0):
+    '''
+    Ecrit un fichier HAR synthétique, entrée par entrée (le fichier n'est jamais construit entièrement en mémoire)
+        Parameters :
+            chemin (string) : le fichier HAR à écrire
+            nb_entrees (int) : le nombre d'entrées
+            graine (int) : la graine du générateur aléatoire
+    '''
+    rnd = random.Random(graine)
+    serveurs, poids = genere_serveurs(rnd)
+    date = datetime.datetime(2022, 12, 1, 11, 32, 53, tzinfo=datetime.timezone.utc)
+    entete = {"version" : "1.2", "creator" : {"name" : "benchmark", "version" : "1.0"},
+              "pages" : [{"startedDateTime" : date.isoformat(timespec='milliseconds'), "id" : "page_1", "title" : "Benchmark",
+                          "pageTimings" : {"onContentLoad" : 800, "onLoad" : 1500}}]}
+    with open(chemin, 'w', encoding="utf-8") as f:
+        f.write('{"log": ' + json.dumps(entete)[:-1] + ', "entries": [\n')
+        for i in range(nb_entrees):
+            hostname, ips = rnd.choices(serveurs, weights=poids)[0]
+            date += datetime.timedelta(milliseconds=rnd.randint(0, 20))
+            f.write((",\n" if i else "") + json.dumps(genere_entree(rnd, hostname, rnd.choice(ips), date)))
+        f.write("\n]}}\n")
+
+
+def chronometre(fonction, *args):
+    '''
+    Exécute une fonction et mesure sa durée
+        Returns :
+            (resultat, duree) : le résultat de la fonction et sa durée en secondes
+    '''
+    debut = time.perf_counter()
+    resultat = fonction(*args)
+    return resultat, time.perf_counter() - debut
+
+
+def lit_entrees(har_file_name):
+    '''
+    Lit toutes les entrées d'un fichier HAR sans les analyser (étape de lecture seule)
+    '''
+    nb = 0
+    for _ in iter_entries(har_file_name, decodeur=analyse.DECODEUR_HAR):
+        nb += 1
+    return nb
+
+
+def mesure(har_file_name, rendu=True, fichier_png=None):
+    '''
+    Chronomètre chaque étape de l'analyse d'un fichier HAR
+        Parameters :
+            har_file_name (string) : le fichier HAR
+            rendu (bool) : si False, l'étape de rendu des graphes n'est pas mesurée
+            fichier_png (string) : l'image produite par l'étape de rendu
+        Returns :
+            durees (dict) : étape -> durée en secondes
+    '''
+    analyse.vide_caches() # chaque taille utilise les memes adresses et hostnames (graine 0) : pas de cache chaud d'une taille à l'autre
+    durees = {}
+    nb_entrees, durees["lecture_json"] = chronometre(lit_entrees, har_file_name)
+    my_data, duree = chronometre(analyse.analyse_har_file, har_file_name)
+    # analyse_har_file (boucle analyse_entry, découpage des hostnames, géolocalisation par lots, écriture du cache)
+    # relit le fichier : on retire la durée de la lecture seule
+    durees["boucle_analyse_entry"] = max(duree - durees["lecture_json"], 0.0)
+    df, durees["construction_dataframe"] = chronometre(my_data.to_dataframe)
+    agregats, durees["agregations"] = chronometre(calcule_agregats, df)
+    if rendu:
+        _, durees["rendu"] = chronometre(analyse.plot_data, agregats, fichier_png)
+    durees["total"] = sum(durees.values())
+    durees["nb_entrees"] = nb_entrees
+    durees["entrees_par_seconde"] = nb_entrees / durees["total"] if durees["total"] else 0.0
+    return durees
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mesure des performances de l'analyse sur des fichiers HAR synthétiques")
+    parser.add_argument("--tailles", type=int, nargs="+", default=TAILLES_DEFAUT, help="nombres d'entrées des fichiers générés (défaut : 1000 100000 1000000, soit environ 2,5 Go pour le plus gros)")
+    parser.add_argument("--repertoire", default="bench_data", help="répertoire des fichiers générés (réutilisés s'ils existent déjà)")
+    parser.add_argument("-o", "--resultats", default="bench_resultats.json", help="fichier JSON des résultats")
+    parser.add_argument("--decodeur", choices=DECODEURS_POSSIBLES, default=analyse.DECODEUR_HAR, help=f"décodeur JSON des fichiers HAR (défaut : {analyse.DECODEUR_HAR})")
+    parser.add_argument("--sans-rendu", action="store_true", help="ne mesure pas le rendu des graphes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.repertoire, exist_ok=True)
+    # Base IP2Location synthétique, et aucun cache conservé d'une exécution à l'autre
+    fichiers_bin = {4 : os.path.join(args.repertoire, "BENCH-DB5.BIN"), 6 : os.path.join(args.repertoire, "BENCH-DB5.IPV6.BIN")}
+    for version, chemin in fichiers_bin.items():
+        if not os.path.exists(chemin):
+            genere_base_ip2location(chemin, 20000, 20000, graine=version)
+    analyse.FICHIERS_IP2LOCATION = fichiers_bin
+    analyse.bases_ip2location.clear()
+    analyse.cacheGeoloc = None
+    analyse.DECODEUR_HAR = args.decodeur
+    if not args.sans_rendu:
+        analyse.get_pyplot("Agg") # l'import de matplotlib n'est pas compté dans la première mesure
+
+    resultats = {"date" : datetime.datetime.now().isoformat(timespec='seconds'), "python" : platform.python_version(), "decodeur" : args.decodeur,
+                 "machine" : platform.platform(), "processeurs" : os.cpu_count(), "mesures" : {}}
+    for taille in args.tailles:
+        har_file_name = os.path.join(args.repertoire, f"bench_{taille}.har")
+        if not os.path.exists(har_file_name):
+            print(f"Génération de {har_file_name} ...")
+            genere_har(har_file_name, taille)
+        durees = mesure(har_file_name, not args.sans_rendu, os.path.join(args.repertoire, f"bench_{taille}.png"))
+        resultats["mesures"][str(taille)] = dict(durees, decodeur=choisit_decodeur(args.decodeur, os.path.getsize(har_file_name)))
+        print(f"{taille} entrées : " + ", ".join(f"{etape} {duree:.3f}s" for etape, duree in durees.items() if etape not in ("nb_entrees", "entrees_par_seconde")))
+    with open(args.resultats, 'w', encoding="utf-8") as f:
+        json.dump(resultats, f, indent=2)
+    print(f"Résultats enregistrés dans {args.resultats}")
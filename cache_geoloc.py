@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Cache de géolocalisation conservé sur disque (SQLite) d'une exécution à l'autre
+
+Les mêmes adresses (CDN, trackers ...) reviennent d'une analyse à l'autre : leurs enregistrements IP2Location (champs DB5)
+sont donc conservés dans une base SQLite. Le cache est associé à la date de construction des fichiers BIN utilisés :
+si la base IP2Location est mise à jour, le cache est vidé automatiquement.
+"""
+
+import os # pour identifier le processus courant
+import sqlite3 # pour la base du cache
+import threading # une connexion par thread (ex : thread de géolocalisation du pipeline)
+from IP2Location.database import IP2LocationRecord # pour reconstruire les enregistrements
+
+from index_ip import lire_entete # pour lire la date de construction des fichiers BIN
+
+
+# Champs DB5 conservés dans le cache
+CHAMPS_DB5 = ['country_short', 'country_long', 'region', 'city', 'latitude', 'longitude']
+# Nombre d'enregistrements ajoutés avant d'écrire sur le disque
+TAILLE_LOT = 1000
+
+
+def version_bases(fichiers):
+    '''
+    Retourne la version (dates de construction) d'un ensemble de fichiers BIN IP2Location
+        Parameters :
+            fichiers : les chemins des fichiers BIN
+        Returns :
+            version (string) : les dates de construction des fichiers (ex : "2022-12-01/2022-12-01")
+    '''
+    dates = []
+    for chemin in fichiers:
+        with open(chemin, 'rb') as f:
+            annee, mois, jour = lire_entete(f.read(32))['date']
+        dates.append(f"{annee:04d}-{mois:02d}-{jour:02d}")
+    return "/".join(dates)
+
+
+class CacheGeoloc:
+    '''
+    Cache disque adresse IP -> enregistrement IP2Location (champs DB5)
+    Chaque thread de chaque processus utilise sa propre connexion à la base (une connexion SQLite ne doit pas être partagée
+    après un fork, ni utilisée par un autre thread que celui qui l'a ouverte)
+    '''
+
+    def __init__(self, chemin, fichiers_bin):
+        '''
+        Parameters :
+            chemin (string) : le fichier SQLite du cache
+            fichiers_bin : les fichiers BIN IP2Location dont les enregistrements sont mis en cache
+        '''
+        self.chemin = chemin
+        self.fichiers_bin = list(fichiers_bin)
+        self.pid = None
+        self.connexions = threading.local() # connexion du thread courant
+        self.verrou = threading.Lock() # protège a_ecrire, alimenté et écrit par des threads différents
+        self.a_ecrire = []
+
+    def connecte(self):
+        '''
+        Retourne la connexion à la base du thread courant, en l'ouvrant (et en vidant le cache s'il correspond à d'autres fichiers BIN) si nécessaire
+        '''
+        if self.pid != os.getpid():
+            # Processus fils (fork) : les connexions et les enregistrements à écrire du processus père ne le concernent pas
+            self.pid = os.getpid()
+            self.connexions = threading.local()
+            self.verrou = threading.Lock()
+            self.a_ecrire = []
+        connexion = getattr(self.connexions, "connexion", None)
+        if connexion is None:
+            connexion = self.connexions.connexion = sqlite3.connect(self.chemin, timeout=30)
+            connexion.execute("PRAGMA journal_mode=WAL") # lectures et écritures concurrentes de plusieurs processus
+            with connexion:
+                connexion.execute("CREATE TABLE IF NOT EXISTS meta (cle TEXT PRIMARY KEY, valeur TEXT)")
+                connexion.execute(f"CREATE TABLE IF NOT EXISTS geoloc (ip TEXT PRIMARY KEY, {', '.join(CHAMPS_DB5)})")
+                version = version_bases(self.fichiers_bin)
+                ligne = connexion.execute("SELECT valeur FROM meta WHERE cle = 'version'").fetchone()
+                if ligne is None or ligne[0] != version:
+                    # Nouvelle version de la base IP2Location : les enregistrements en cache ne sont plus valables
+                    connexion.execute("DELETE FROM geoloc")
+                    connexion.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+        return connexion
+
+    def get(self, ip):
+        '''
+        Recherche l'enregistrement d'une adresse IP dans le cache
+            Parameters :
+                ip (string) : l'adresse IP
+            Returns :
+                rec (IP2LocationRecord) : l'enregistrement, ou None si l'adresse n'est pas en cache
+        '''
+        ligne = self.connecte().execute(f"SELECT {', '.join(CHAMPS_DB5)} FROM geoloc WHERE ip = ?", (ip,)).fetchone()
+        if ligne is None:
+            return None
+        rec = IP2LocationRecord()
+        rec.ip = ip
+        for champ, valeur in zip(CHAMPS_DB5, ligne):
+            setattr(rec, champ, valeur)
+        return rec
+
+    def ajoute(self, ip, rec):
+        '''
+        Ajoute l'enregistrement d'une adresse IP au cache (écrit sur le disque par lots, voir ecrit)
+            Parameters :
+                ip (string) : l'adresse IP
+                rec (IP2LocationRecord) : l'enregistrement
+        '''
+        self.connecte()
+        with self.verrou:
+            self.a_ecrire.append((ip,) + tuple(getattr(rec, champ) for champ in CHAMPS_DB5))
+            plein = len(self.a_ecrire) >= TAILLE_LOT
+        if plein:
+            self.ecrit()
+
+    def ecrit(self):
+        '''
+        Ecrit sur le disque les enregistrements ajoutés depuis la dernière écriture
+        '''
+        if self.a_ecrire and self.pid == os.getpid():
+            with self.verrou:
+                lignes, self.a_ecrire = self.a_ecrire, []
+            with self.connecte() as connexion:
+                connexion.executemany(f"INSERT OR REPLACE INTO geoloc VALUES ({', '.join('?' * (len(CHAMPS_DB5) + 1))})", lignes)
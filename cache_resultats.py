@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Cache des résultats d'analyse par fichier HAR, pour ne ré-analyser que les fichiers nouveaux ou modifiés
+
+Chaque fichier est identifié par une empreinte de son contenu (BLAKE2b), complétée par tout ce qui peut changer le résultat de
+l'analyse : version de l'outil, dates des bases IP2Location, version de la Public Suffix List et page analysée.
+Les agrégats d'un fichier déjà analysé avec la même clé sont relus directement depuis le cache.
+"""
+
+import hashlib # pour l'empreinte des fichiers
+import os # pour identifier le processus courant
+import pickle # pour sauvegarder les agrégats
+import sqlite3 # pour la base du cache
+
+from cache_geoloc import version_bases # dates des fichiers BIN IP2Location
+from suffixes_publics import version_liste # version de la Public Suffix List
+
+
+# A incrémenter à chaque modification de l'analyse qui change ses résultats (invalide tout le cache)
+VERSION_ANALYSE = "6"
+TAILLE_BLOC = 1 << 20
+
+
+def empreinte_donnees(donnees):
+    '''
+    Calcule l'empreinte du contenu d'un fichier déjà lu
+        Parameters :
+            donnees (bytes) : le contenu du fichier
+        Returns :
+            empreinte (string) : l'empreinte BLAKE2b (en hexadécimal), identique à celle de empreinte_fichier
+    '''
+    return hashlib.blake2b(donnees, digest_size=20).hexdigest()
+
+
+def empreinte_fichier(chemin):
+    '''
+    Calcule l'empreinte du contenu d'un fichier
+        Parameters :
+            chemin (string) : le chemin du fichier
+        Returns :
+            empreinte (string) : l'empreinte BLAKE2b (en hexadécimal)
+    '''
+    h = hashlib.blake2b(digest_size=20)
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(TAILLE_BLOC), b''):
+            h.update(bloc)
+    return h.hexdigest()
+
+
+def version_outils(fichiers_bin):
+    '''
+    Retourne la partie de la clé du cache qui ne dépend pas du fichier HAR
+        Parameters :
+            fichiers_bin : les fichiers BIN IP2Location utilisés
+        Returns :
+            version (string) : version de l'analyse, des bases IP2Location et de la Public Suffix List
+    '''
+    return f"{VERSION_ANALYSE}|{version_bases(fichiers_bin)}|{version_liste()}"
+
+
+def cle_fichier(chemin, version, page_id=None, donnees=None):
+    '''
+    Retourne la clé du cache d'un fichier HAR
+        Parameters :
+            chemin (string) : le chemin du fichier HAR
+            version (string) : la version des outils (voir version_outils)
+            page_id (string) : la page analysée, ou None pour toutes les entrées
+            donnees (bytes) : le contenu du fichier s'il a déjà été lu (le fichier n'est alors pas relu)
+        Returns :
+            cle (string) : la clé
+    '''
+    empreinte = empreinte_fichier(chemin) if donnees is None else empreinte_donnees(donnees)
+    return f"{empreinte}|{version}|{page_id or ''}"
+
+
+class CacheResultats:
+    '''
+    Cache disque (SQLite) clé d'un fichier HAR -> agrégats de ce fichier
+    '''
+
+    def __init__(self, chemin):
+        '''
+        Parameters :
+            chemin (string) : le fichier SQLite du cache
+        '''
+        self.chemin = chemin
+        self.connexion = None
+        self.pid = None
+
+    def connecte(self):
+        '''
+        Retourne la connexion à la base du processus courant, en l'ouvrant si nécessaire
+        '''
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connexion = sqlite3.connect(self.chemin, timeout=30)
+            self.connexion.execute("PRAGMA journal_mode=WAL")
+            with self.connexion:
+                self.connexion.execute("CREATE TABLE IF NOT EXISTS resultats (cle TEXT PRIMARY KEY, agregats BLOB)")
+        return self.connexion
+
+    def __getstate__(self):
+        # Le cache est transmis aux processus fils : la connexion du processus courant ne peut pas être sérialisée
+        return {"chemin" : self.chemin, "connexion" : None, "pid" : None}
+
+    def get(self, cle):
+        '''
+        Retourne les agrégats associés à une clé
+            Parameters :
+                cle (string) : la clé du fichier (voir cle_fichier)
+            Returns :
+                agregats (Agregats) : les agrégats, ou None si la clé n'est pas dans le cache
+        '''
+        ligne = self.connecte().execute("SELECT agregats FROM resultats WHERE cle = ?", (cle,)).fetchone()
+        return None if ligne is None else pickle.loads(ligne[0])
+
+    def ajoute(self, cle, agregats):
+        '''
+        Enregistre les agrégats d'un fichier
+            Parameters :
+                cle (string) : la clé du fichier (voir cle_fichier)
+                agregats (Agregats) : les agrégats du fichier
+        '''
+        with self.connecte() as connexion:
+            connexion.execute("INSERT OR REPLACE INTO resultats VALUES (?, ?)",
+                              (cle, pickle.dumps(agregats, protocol=pickle.HIGHEST_PROTOCOL)))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analyse d'un corpus de fichiers HAR (un répertoire ou un motif glob) répartie sur plusieurs processus
+
+Chaque processus analyse des fichiers entiers (lecture + analyse_entry) et ne renvoie que les agrégats par pays et par domaine,
+qui sont ensuite fusionnés. Un fichier illisible ou corrompu est signalé mais n'interrompt pas l'analyse des autres.
+Les agrégats de chaque fichier sont conservés dans un cache (voir cache_resultats) : seuls les fichiers nouveaux ou modifiés sont ré-analysés.
+
+Pour un corpus sur un stockage réseau, le mode pipeline (--pipeline) enchaine les étapes dans un seul processus, chacune dans son thread :
+lecture des fichiers suivants, analyse des entrées du fichier courant, géolocalisation par lots, agrégation. Les étapes sont reliées par des
+files bornées, si bien que la mémoire reste limitée à quelques fichiers en cours, et que la durée totale tend vers celle de l'étape la plus lente.
+
+Utilisation : python corpus.py <répertoire ou motif> [-j nb_processus] [--page page_id] [--decodeur auto|ijson|orjson|simdjson|json] [--sortie ecran|png|json|csv] [-o fichier] [--cache fichier | --sans-cache] [--echanges répertoire] [--pipeline [--lecteurs n] [--file n]] [--profil [--profil-memoire] [--cprofile fichier]] [-v | -q]
+"""
+
+import argparse # pour les arguments de la ligne de commande
+import glob # pour les motifs de fichiers
+import hashlib # pour nommer les fichiers exportés
+import logging # pour les messages de diagnostic
+import os # pour les chemins
+import queue # files bornées entre les étapes du pipeline
+import threading # étapes du pipeline
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed # pour répartir les fichiers sur plusieurs processus (ou threads)
+
+import analyse_fichier_HAR as analyse # fonctions d'analyse d'un fichier HAR
+from agregation import Agregats, calcule_agregats, fusionne_agregats # agrégats par fichier puis fusion
+from lecture_har import DECODEURS_POSSIBLES # décodeurs JSON des fichiers HAR
+from table_echanges import TableEchanges, infos_entree, exporte_echanges # table des échanges et export en colonnes
+from cache_resultats import CacheResultats, cle_fichier, version_outils # pour ne pas ré-analyser les fichiers inchangés
+from profilage import profil # mesures de chaque processus, fusionnées dans le rapport final
+
+
+FICHIER_CACHE_RESULTATS = "resultats_cache.sqlite"
+# Mode pipeline : nombre de threads de lecture, et nombre maximum de fichiers en attente entre deux étapes
+NB_LECTEURS = 2
+TAILLE_FILES = 4
+FIN = None # marque de fin envoyée dans les files du pipeline
+
+
+def liste_fichiers(motif):
+    '''
+    Liste les fichiers HAR d'un corpus
+        Parameters :
+            motif (string) : un répertoire (tous les .har qu'il contient, sous-répertoires compris) ou un motif glob
+        Returns :
+            fichiers (list) : la liste triée des chemins des fichiers
+    '''
+    if os.path.isdir(motif):
+        motif = os.path.join(motif, "**", "*.har")
+    return sorted(f for f in glob.glob(motif, recursive=True) if os.path.isfile(f))
+
+
+def fichier_echanges_corpus(har_file_name, repertoire_echanges):
+    '''
+    Retourne le fichier Parquet dans lequel est exportée la table des échanges d'un fichier HAR du corpus
+    Le nom est préfixé par une empreinte du chemin complet, pour distinguer les fichiers de même nom de répertoires différents
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR
+            repertoire_echanges (string) : le répertoire des exports
+        Returns :
+            fichier (string) : le chemin du fichier Parquet
+    '''
+    empreinte = hashlib.blake2b(os.path.abspath(har_file_name).encode(), digest_size=4).hexdigest()
+    nom = os.path.splitext(os.path.basename(har_file_name))[0]
+    return os.path.join(repertoire_echanges, f"{empreinte}_{nom}.parquet")
+
+
+def analyse_fichier_corpus(har_file_name, page_id=None, cache=None, version=None, repertoire_echanges=None, profilage=None, decodeur=None):
+    '''
+    Analyse un fichier du corpus et retourne ses agrégats (fonction exécutée dans un processus fils)
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR
+            page_id (string) : la page à analyser, ou None pour toutes les entrées
+            cache (CacheResultats) : le cache des résultats, ou None pour toujours analyser le fichier
+            version (string) : la version des outils (voir version_outils), nécessaire si cache est renseigné
+            repertoire_echanges (string) : si renseigné, la table des échanges du fichier y est exportée en Parquet
+            profilage (dict) : si renseigné, paramètres de active_profilage (le fichier est analysé avec le profilage activé)
+            decodeur (string) : le décodeur JSON du fichier (voir analyse.DECODEUR_HAR), None pour celui du processus
+        Returns :
+            agregats (Agregats) : les agrégats partiels du fichier
+            cle (string) : la clé du fichier dans le cache (None sans cache)
+            en_cache (bool) : True si les agrégats proviennent du cache
+            releve (dict) : les mesures du profilage pour ce fichier (voir Profilage.releve), None sans profilage
+            stats_ip (dict) : l'efficacité du cache de géolocalisation du processus depuis son lancement (voir analyse.stats_cache_ip)
+    '''
+    if decodeur is not None:
+        analyse.DECODEUR_HAR = decodeur
+    if profilage is not None:
+        analyse.active_profilage(**profilage)
+        profil.reinitialise() # chaque fichier renvoie ses propres mesures
+    agregats, cle, en_cache = analyse_fichier_corpus_sans_profil(har_file_name, page_id, cache, version, repertoire_echanges)
+    return agregats, cle, en_cache, (profil.releve() if profilage is not None else None), analyse.stats_cache_ip()
+
+
+def analyse_fichier_corpus_sans_profil(har_file_name, page_id, cache, version, repertoire_echanges):
+    cle = None
+    fichier_echanges = fichier_echanges_corpus(har_file_name, repertoire_echanges) if repertoire_echanges else None
+    if cache is not None:
+        cle = cle_fichier(har_file_name, version, page_id)
+        agregats = cache.get(cle)
+        # Un fichier inchangé n'est relu dans le cache que si sa table des échanges a déjà été exportée (quand elle est demandée)
+        if agregats is not None and (fichier_echanges is None or os.path.exists(fichier_echanges)):
+            return agregats, cle, True
+    my_data = analyse.analyse_har_file(har_file_name, page_id)
+    with profil.etape("construction_dataframe"):
+        df = my_data.to_dataframe()
+    if fichier_echanges is not None:
+        with profil.etape("export_echanges"):
+            exporte_echanges(df, fichier_echanges, "parquet")
+    with profil.etape("agregations"):
+        agregats = calcule_agregats(df)
+    return agregats, cle, False
+
+
+def analyse_corpus(fichiers, nb_processus=None, page_id=None, fichier_cache=FICHIER_CACHE_RESULTATS, repertoire_echanges=None, profilage=None,
+                   decodeur=None):
+    '''
+    Analyse un ensemble de fichiers HAR en parallèle et fusionne leurs agrégats
+        Parameters :
+            fichiers (list) : les chemins des fichiers HAR
+            nb_processus (int) : le nombre de processus (par défaut, le nombre de coeurs)
+            page_id (string) : la page à analyser dans chaque fichier, ou None pour toutes les entrées
+            fichier_cache (string) : le fichier du cache des résultats, ou None pour tout ré-analyser
+            repertoire_echanges (string) : si renseigné, la table des échanges de chaque fichier y est exportée en Parquet
+            profilage (dict) : si renseigné, les fichiers sont analysés avec le profilage activé (paramètres de active_profilage) ;
+                les mesures des processus fils sont ajoutées à celles du processus principal
+            decodeur (string) : le décodeur JSON des fichiers (voir analyse.DECODEUR_HAR), None pour celui par défaut
+        Returns :
+            agregats (Agregats) : les agrégats de tout le corpus
+            erreurs (dict) : chemin -> message d'erreur, pour les fichiers qui n'ont pas pu être analysés
+            nb_en_cache (int) : le nombre de fichiers dont les agrégats ont été relus dans le cache
+            stats_ip (dict) : l'efficacité des caches de géolocalisation, cumulée sur tous les processus (voir analyse.cumule_stats_cache_ip)
+    '''
+    partiels = []
+    erreurs = {}
+    nb_en_cache = 0
+    stats_ip = []
+    cache = CacheResultats(fichier_cache) if fichier_cache else None
+    version = version_outils(analyse.FICHIERS_IP2LOCATION.values()) if cache is not None else None
+    if repertoire_echanges:
+        os.makedirs(repertoire_echanges, exist_ok=True)
+    # Chaque processus fils ouvre ses propres bases IP2Location à la première adresse à géolocaliser
+    with ProcessPoolExecutor(max_workers=nb_processus) as pool:
+        taches = {pool.submit(analyse_fichier_corpus, f, page_id, cache, version, repertoire_echanges, profilage, decodeur) : f for f in fichiers}
+        for tache in as_completed(taches):
+            fichier = taches[tache]
+            try:
+                agregats, cle, en_cache, releve, stats = tache.result()
+            except Exception as e: # un fichier corrompu ne doit pas interrompre le reste du corpus
+                erreurs[fichier] = decrit_erreur(e)
+                continue
+            partiels.append(agregats)
+            stats_ip.append(stats)
+            if releve is not None:
+                profil.fusionne(releve)
+            if en_cache:
+                nb_en_cache += 1
+            elif cache is not None:
+                cache.ajoute(cle, agregats) # seul le processus principal écrit dans le cache
+    with profil.etape("fusion_agregats"):
+        agregats = fusionne_agregats(partiels)
+    return agregats, erreurs, nb_en_cache, analyse.cumule_stats_cache_ip(stats_ip)
+
+
+def decrit_erreur(e):
+    '''
+    Retourne le message d'erreur d'un fichier qui n'a pas pu être analysé (sur une seule ligne)
+    '''
+    return f"{type(e).__name__} : {' '.join(str(e).split())}"
+
+
+def lit_fichiers(chemins, sortie):
+    '''
+    Etape de lecture du pipeline (un thread par lecteur) : lit le contenu des fichiers de la file chemins
+    Le thread est bloqué tant que la file de sortie est pleine, ce qui limite le nombre de fichiers chargés en mémoire
+        Parameters :
+            chemins (queue.Queue) : les chemins des fichiers à lire (partagée entre les lecteurs)
+            sortie (queue.Queue) : reçoit (chemin, contenu, erreur) pour chaque fichier, puis FIN
+    '''
+    try:
+        while True:
+            try:
+                chemin = chemins.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                with open(chemin, 'rb') as f:
+                    sortie.put((chemin, f.read(), None))
+            except OSError as e:
+                sortie.put((chemin, None, e))
+    finally:
+        sortie.put(FIN)
+
+
+def geolocalise_lot(ips):
+    '''
+    Géolocalise les adresses IP distinctes d'un fichier (exécuté par le thread de géolocalisation du pipeline)
+        Parameters :
+            ips (list) : les adresses IP
+        Returns :
+            country_codes (dict) : adresse IP -> code pays
+    '''
+    country_codes = analyse.get_country_codes(ips)
+    analyse.ecrit_cache_geoloc()
+    return country_codes
+
+
+def analyse_contenu(har_file_name, donnees, page_id, pool_geoloc):
+    '''
+    Analyse les entrées d'un fichier déjà lu, sans les géolocaliser : les adresses IP distinctes du fichier sont envoyées
+    en un seul lot au thread de géolocalisation
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR (pour les messages)
+            donnees (bytes) : le contenu du fichier
+            page_id (string) : la page à analyser, ou None pour toutes les entrées
+            pool_geoloc (ThreadPoolExecutor) : le thread de géolocalisation
+        Returns :
+            my_data (TableEchanges) : la table des échanges, dont la colonne country contient encore les adresses IP
+            geoloc (Future) : le résultat à venir de la géolocalisation (adresse IP -> code pays)
+    '''
+    my_data = TableEchanges()
+    pages = {}
+    nb_analysees, nb_ignorees = analyse.analyse_entrees(donnees, lambda a, e: my_data.ajoute(a + infos_entree(e)), page_id, pages,
+                                                        geolocalise=False, decoupe=False)
+    analyse.decoupe_hostnames([my_data])
+    my_data.ajoute_pages(pages)
+    analyse.affiche_bilan_entrees(har_file_name, nb_analysees, nb_ignorees)
+    return my_data, pool_geoloc.submit(geolocalise_lot, list(my_data.colonnes['country'].vocabulaire.valeurs))
+
+
+def analyse_fichiers_lus(entree, sortie, nb_lecteurs, pool_geoloc, page_id, fichier_cache, version, repertoire_echanges):
+    '''
+    Etape d'analyse du pipeline (un thread) : analyse les fichiers lus, sauf ceux dont les agrégats sont dans le cache
+        Parameters :
+            entree (queue.Queue) : reçoit (chemin, contenu, erreur) de chaque lecteur, puis FIN de chacun
+            sortie (queue.Queue) : reçoit (chemin, cle, resultat, erreur) pour chaque fichier, puis FIN ; resultat est
+                soit un Agregats (relu dans le cache), soit (TableEchanges, Future de la géolocalisation)
+            nb_lecteurs (int) : le nombre de lecteurs
+            pool_geoloc (ThreadPoolExecutor) : le thread de géolocalisation
+            page_id, version, repertoire_echanges : voir analyse_fichier_corpus
+            fichier_cache (string) : le fichier du cache des résultats, ou None
+    '''
+    cache = CacheResultats(fichier_cache) if fichier_cache else None # connexion propre à ce thread
+    try:
+        nb_termines = 0
+        while nb_termines < nb_lecteurs:
+            element = entree.get()
+            if element is FIN:
+                nb_termines += 1
+                continue
+            chemin, donnees, erreur = element
+            cle = resultat = None
+            if erreur is None:
+                try:
+                    if cache is not None:
+                        cle = cle_fichier(chemin, version, page_id, donnees)
+                        resultat = cache.get(cle)
+                        if resultat is not None and repertoire_echanges and not os.path.exists(fichier_echanges_corpus(chemin, repertoire_echanges)):
+                            resultat = None
+                    if resultat is None:
+                        resultat = analyse_contenu(chemin, donnees, page_id, pool_geoloc)
+                except Exception as e: # un fichier corrompu ne doit pas interrompre le reste du corpus
+                    erreur = e
+            sortie.put((chemin, cle, resultat, erreur))
+    finally:
+        sortie.put(FIN)
+
+
+def analyse_corpus_pipeline(fichiers, page_id=None, fichier_cache=FICHIER_CACHE_RESULTATS, repertoire_echanges=None,
+                            nb_lecteurs=NB_LECTEURS, taille_files=TAILLE_FILES):
+    '''
+    Analyse un ensemble de fichiers HAR en pipeline (voir l'en-tête du module) et fusionne leurs agrégats
+    Les étapes se recouvrent : pendant que le fichier courant est analysé, les suivants sont lus et le précédent est géolocalisé puis agrégé.
+    Les threads partagent un seul processus (et donc le GIL) : ce mode est adapté quand la lecture des fichiers est lente (stockage réseau) ;
+    pour un corpus local, la répartition sur plusieurs processus (analyse_corpus) reste préférable.
+        Parameters :
+            fichiers, page_id, fichier_cache, repertoire_echanges : voir analyse_corpus
+            nb_lecteurs (int) : le nombre de threads de lecture
+            taille_files (int) : le nombre maximum de fichiers en attente entre deux étapes (limite la mémoire utilisée)
+        Returns :
+            agregats, erreurs, nb_en_cache, stats_ip : voir analyse_corpus
+    '''
+    partiels = []
+    erreurs = {}
+    nb_en_cache = 0
+    cache = CacheResultats(fichier_cache) if fichier_cache else None
+    version = version_outils(analyse.FICHIERS_IP2LOCATION.values()) if cache is not None else None
+    if repertoire_echanges:
+        os.makedirs(repertoire_echanges, exist_ok=True)
+    chemins = queue.Queue()
+    for f in fichiers:
+        chemins.put(f)
+    lus = queue.Queue(maxsize=taille_files)
+    analyses = queue.Queue(maxsize=taille_files)
+    # Un seul thread de géolocalisation : les bases IP2Location ouvertes et la connexion au cache de géolocalisation ne sont pas partagées entre threads
+    with ThreadPoolExecutor(max_workers=1) as pool_geoloc:
+        threads = [threading.Thread(target=lit_fichiers, args=(chemins, lus), daemon=True) for _ in range(nb_lecteurs)]
+        threads.append(threading.Thread(target=analyse_fichiers_lus, daemon=True,
+                                        args=(lus, analyses, nb_lecteurs, pool_geoloc, page_id, fichier_cache, version, repertoire_echanges)))
+        for thread in threads:
+            thread.start()
+        # Etape finale (thread principal) : code pays de chaque échange, agrégats, export et écriture dans le cache
+        while True:
+            element = analyses.get()
+            if element is FIN:
+                break
+            chemin, cle, resultat, erreur = element
+            if erreur is None and isinstance(resultat, Agregats):
+                partiels.append(resultat)
+                nb_en_cache += 1
+                continue
+            if erreur is None:
+                try:
+                    my_data, geoloc = resultat
+                    analyse.geolocalise_tables([my_data], geoloc.result())
+                    df = my_data.to_dataframe()
+                    if repertoire_echanges:
+                        exporte_echanges(df, fichier_echanges_corpus(chemin, repertoire_echanges), "parquet")
+                    agregats = calcule_agregats(df)
+                except Exception as e:
+                    erreur = e
+            if erreur is not None:
+                erreurs[chemin] = decrit_erreur(erreur)
+                continue
+            partiels.append(agregats)
+            if cache is not None:
+                cache.ajoute(cle, agregats)
+        for thread in threads:
+            thread.join()
+    with profil.etape("fusion_agregats"):
+        agregats = fusionne_agregats(partiels)
+    return agregats, erreurs, nb_en_cache, analyse.cumule_stats_cache_ip([analyse.stats_cache_ip()]) # géolocalisation dans ce processus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse d'un corpus de fichiers HAR")
+    parser.add_argument("corpus", help="répertoire contenant les fichiers .har, ou motif glob (ex : 'crawl/*.har')")
+    parser.add_argument("-j", "--processus", type=int, default=None, help="nombre de processus (défaut : nombre de coeurs)")
+    parser.add_argument("--page", default=None, help="identifiant de la page à analyser dans chaque fichier (défaut : toutes)")
+    parser.add_argument("--sortie", choices=analyse.MODES_SORTIE, default="ecran", help="mode de sortie des résultats (défaut : ecran)")
+    parser.add_argument("-o", "--fichier", default=None, help="fichier produit pour les sorties png, json et csv (défaut : corpus.<sortie>)")
+    parser.add_argument("--decodeur", choices=DECODEURS_POSSIBLES, default=analyse.DECODEUR_HAR, help=f"décodeur JSON des fichiers HAR (défaut : {analyse.DECODEUR_HAR})")
+    parser.add_argument("--cache", default=FICHIER_CACHE_RESULTATS, help=f"fichier du cache des résultats (défaut : {FICHIER_CACHE_RESULTATS})")
+    parser.add_argument("--sans-cache", action="store_true", help="ré-analyse tous les fichiers sans utiliser le cache")
+    parser.add_argument("--echanges", default=None, help="répertoire où exporter la table des échanges de chaque fichier (Parquet, un fichier par HAR)")
+    parser.add_argument("--pipeline", action="store_true", help="analyse en pipeline dans un seul processus (lecture, analyse, géolocalisation et agrégation se recouvrent), pour un corpus sur un stockage lent ; -j est alors ignoré")
+    parser.add_argument("--lecteurs", type=int, default=NB_LECTEURS, help=f"mode pipeline : nombre de threads de lecture (défaut : {NB_LECTEURS})")
+    parser.add_argument("--file", type=int, default=TAILLE_FILES, help=f"mode pipeline : nombre maximum de fichiers en attente entre deux étapes (défaut : {TAILLE_FILES})")
+    parser.add_argument("--profil", action="store_true", help="affiche en fin d'exécution la durée de chaque étape et le nombre d'appels des fonctions de géolocalisation et de domaine")
+    parser.add_argument("--profil-memoire", action="store_true", help="avec --profil, mesure aussi le pic de mémoire de chaque étape (plus lent)")
+    parser.add_argument("--cprofile", default=None, help="avec --profil, enregistre un profil cProfile du processus principal dans ce fichier")
+    parser.add_argument("-v", "--verbeux", action="store_true", help="affiche le détail de chaque entrée analysée")
+    parser.add_argument("-q", "--silencieux", action="store_true", help="n'affiche pas le bilan de chaque fichier")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbeux else logging.WARNING if args.silencieux else logging.INFO, format="%(message)s")
+
+    profilage = None
+    if args.profil:
+        profilage = {"memoire" : args.profil_memoire}
+        analyse.active_profilage(args.profil_memoire, args.cprofile) # cProfile ne suit que le processus principal
+
+    analyse.DECODEUR_HAR = args.decodeur # mode pipeline (et processus fils créés par fork)
+    fichiers = liste_fichiers(args.corpus)
+    fichier_cache = None if args.sans_cache else args.cache
+    with profil.etape("corpus"):
+        if args.pipeline:
+            agregats, erreurs, nb_en_cache, stats_ip = analyse_corpus_pipeline(fichiers, args.page, fichier_cache, args.echanges, args.lecteurs, args.file)
+        else:
+            agregats, erreurs, nb_en_cache, stats_ip = analyse_corpus(fichiers, args.processus, args.page, fichier_cache, args.echanges, profilage,
+                                                                      args.decodeur)
+    print("="*20)
+    print(f"Fichiers analysés : {len(fichiers) - len(erreurs)}/{len(fichiers)} (dont {nb_en_cache} inchangés, relus dans le cache)")
+    for fichier, erreur in sorted(erreurs.items()):
+        print(f"Erreur sur {fichier} : {erreur}")
+    if stats_ip is not None:
+        analyse.affiche_stats_cache_ip(stats_ip)
+    print(f"Nombre de domaine de second niveau : {agregats.nb_domain}")
+    analyse.affiche_latences(agregats)
+    analyse.sortie_resultats(agregats, args.sortie, args.fichier or f"corpus.{args.sortie}")
+    if profil.actif:
+        print(profil.termine())
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Index en mémoire des bases IP2Location (fichiers BIN DB5)
+
+Chaque appel à IP2Location.get_all() relit le fichier et décode tous les champs DB5, alors que l'analyse n'utilise que le code pays.
+Ici on lit une seule fois les plages d'adresses des fichiers BIN dans des tableaux NumPy triés :
+    - le début de chaque plage (uint32 pour IPV4, 16 octets big-endian pour IPV6)
+    - le code pays de chaque plage, sous forme d'indice dans une petite table des pays
+Une recherche revient alors à un np.searchsorted, qui peut traiter d'un coup tout un tableau d'adresses.
+"""
+
+import ipaddress # pour convertir les adresses IP en entiers
+import mmap # pour lire les fichiers BIN sans les copier en mémoire
+import struct # pour lire l'entête des fichiers BIN
+import numpy as np # pour les tableaux de plages d'adresses
+
+
+# Position (en colonnes de 4 octets) du pointeur vers le pays dans une ligne DB5, adresse de début de plage comprise
+COLONNE_PAYS = 2
+ADRESSE_INVALIDE = "INVALID IP ADDRESS"
+
+
+def lire_entete(donnees):
+    '''
+    Lit l'entête d'un fichier BIN IP2Location
+        Parameters :
+            donnees (bytes) : le contenu du fichier BIN
+        Returns :
+            entete (dict) : nombre de colonnes, date de la base, nombre et position des lignes IPV4 et IPV6
+    '''
+    (dbtype, dbcolumn, annee, mois, jour, ipv4_count, ipv4_addr,
+     ipv6_count, ipv6_addr) = struct.unpack('<BBBBBIIII', donnees[0:21])
+    return {'dbtype' : dbtype, 'dbcolumn' : dbcolumn, 'date' : (2000 + annee, mois, jour),
+            'ipv4_count' : ipv4_count, 'ipv4_addr' : ipv4_addr,
+            'ipv6_count' : ipv6_count, 'ipv6_addr' : ipv6_addr}
+
+
+def lire_chaine(donnees, position):
+    '''
+    Lit une chaine IP2Location (un octet de longueur suivi des caractères)
+        Parameters :
+            donnees (bytes) : le contenu du fichier BIN
+            position (int) : la position (à partir de 0) de l'octet de longueur
+        Returns :
+            chaine (string) : la chaine lue
+    '''
+    longueur = donnees[position]
+    return donnees[position + 1 : position + 1 + longueur].decode('iso-8859-1')
+
+
+def lire_plages(chemin, version):
+    '''
+    Lit les plages d'adresses d'une famille (IPV4 ou IPV6) d'un fichier BIN IP2Location
+        Parameters :
+            chemin (string) : le chemin du fichier BIN
+            version (int) : 4 ou 6
+        Returns :
+            debuts (np.array) : le début de chaque plage, trié (uint32 en IPV4, 'S16' big-endian en IPV6)
+            codes (np.array) : pour chaque plage, l'indice du pays dans la table des pays
+            pays (np.array) : la table des codes pays (country_short)
+    '''
+    with open(chemin, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as donnees:
+        return lire_plages_mmap(donnees, version)
+
+
+def lire_plages_mmap(donnees, version):
+    '''
+    Lit les plages d'adresses d'une famille (IPV4 ou IPV6) à partir du contenu d'un fichier BIN (voir lire_plages)
+    '''
+    entete = lire_entete(donnees)
+    nb_mots_ip = 1 if version == 4 else 4
+    nb_colonnes = entete['dbcolumn'] - 1
+    ligne = np.dtype([('ip', '<u4', (nb_mots_ip,)), ('colonnes', '<u4', (nb_colonnes,))])
+    # Les positions dans les fichiers BIN commencent à 1
+    debut = entete[f'ipv{version}_addr'] - 1
+    nb_lignes = entete[f'ipv{version}_count']
+    lignes = np.frombuffer(donnees, dtype=ligne, count=nb_lignes, offset=debut)
+
+    # Les tableaux sont copiés : ils ne doivent pas dépendre du fichier, qui est refermé ensuite
+    if version == 4:
+        debuts = lignes['ip'][:, 0].copy()
+    else:
+        # Les 4 mots de 32 bits sont stockés du poids faible au poids fort : on les remet dans l'ordre big-endian
+        mots = lignes['ip'][:, ::-1].astype('>u4')
+        debuts = np.ascontiguousarray(mots).view('S16').ravel()
+
+    # Chaque ligne pointe vers la chaine du pays : on ne décode qu'une fois chaque pointeur distinct
+    pointeurs, codes = np.unique(lignes['colonnes'][:, COLONNE_PAYS - 2], return_inverse=True)
+    del lignes
+    pays = np.array([lire_chaine(donnees, int(p)) for p in pointeurs], dtype=object)
+    return debuts, codes.astype(np.uint16), pays
+
+
+class IndexIP:
+    '''
+    Index en mémoire des plages d'adresses IP2Location, ne conservant que le code pays
+    '''
+
+    def __init__(self, chemin_ipv4, chemin_ipv6):
+        '''
+        Prépare l'index : les plages IPV4 seront lues dans le premier fichier et les plages IPV6 dans le second,
+        chaque famille n'étant chargée qu'à sa première recherche
+            Parameters :
+                chemin_ipv4 (string) : le fichier BIN IPV4 (ex : IP2LOCATION-LITE-DB5.BIN)
+                chemin_ipv6 (string) : le fichier BIN IPV6 (ex : IP2LOCATION-LITE-DB5.IPV6.BIN)
+        '''
+        self.chemins = {4 : chemin_ipv4, 6 : chemin_ipv6}
+        self.plages = {}
+
+    def get_plages(self, version):
+        '''
+        Retourne les plages d'une famille d'adresses, en les chargeant si nécessaire
+            Parameters :
+                version (int) : 4 ou 6
+            Returns :
+                (debuts, codes, pays) : voir lire_plages
+        '''
+        if version not in self.plages:
+            self.plages[version] = lire_plages(self.chemins[version], version)
+        return self.plages[version]
+
+    def get_country_codes_v4(self, ips):
+        '''
+        Recherche vectorisée des codes pays d'un tableau d'adresses IPV4
+            Parameters :
+                ips (np.array) : les adresses IPV4 sous forme d'entiers (uint32)
+            Returns :
+                country_codes (np.array) : les codes pays
+        '''
+        debuts, codes, pays = self.get_plages(4)
+        lignes = np.searchsorted(debuts, ips, side='right') - 1
+        return pays[codes[lignes]]
+
+    def get_country_codes_v6(self, ips):
+        '''
+        Recherche vectorisée des codes pays d'un tableau d'adresses IPV6
+            Parameters :
+                ips (np.array) : les adresses IPV6 sous forme de 16 octets big-endian (dtype 'S16')
+            Returns :
+                country_codes (np.array) : les codes pays
+        '''
+        debuts, codes, pays = self.get_plages(6)
+        lignes = np.searchsorted(debuts, ips, side='right') - 1
+        return pays[codes[lignes]]
+
+    def get_country_codes(self, ips):
+        '''
+        Retourne les codes pays d'une liste d'adresses IP (IPV4 et IPV6 mélangées)
+            Parameters :
+                ips : une liste (ou un tableau) d'adresses IP sous forme de chaines
+            Returns :
+                country_codes (np.array) : les codes pays, dans le même ordre que ips
+        '''
+        ips = list(ips)
+        res = np.full(len(ips), ADRESSE_INVALIDE, dtype=object)
+        rang_v4, ip_v4, rang_v6, ip_v6 = [], [], [], []
+        for i, ip in enumerate(ips):
+            try:
+                adresse = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            if adresse.version == 6:
+                # Adresses IPV6 qui encapsulent une adresse IPV4 (même traitement que la bibliothèque IP2Location)
+                adresse = adresse.ipv4_mapped or adresse.sixtofour or (adresse.teredo and adresse.teredo[1]) or adresse
+            if adresse.version == 4:
+                rang_v4.append(i)
+                ip_v4.append(int(adresse))
+            else:
+                rang_v6.append(i)
+                ip_v6.append(adresse.packed)
+        if rang_v4:
+            res[rang_v4] = self.get_country_codes_v4(np.array(ip_v4, dtype=np.uint32))
+        if rang_v6:
+            res[rang_v6] = self.get_country_codes_v6(np.array(ip_v6, dtype='S16'))
+        return res
+
+    def get_country_code(self, ip):
+        '''
+        Retourne le code pays associé à une adresse IP
+            Parameters :
+                ip (string) : l'adresse IP
+            Returns :
+                country_code (string) : le code pays
+        '''
+        return self.get_country_codes([ip])[0]
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Lecture incrémentale des fichiers HAR
+
+Au lieu de charger tout le fichier avec json.loads (texte brut + dictionnaire + objets haralyzer en mémoire
+en même temps), on parcourt log.entries entrée par entrée avec ijson. Le corps des réponses
+(response.content.text, souvent en base64) est ignoré au fil de la lecture : il n'est jamais rangé dans l'entrée.
+La mémoire utilisée reste donc de l'ordre d'une entrée, quelle que soit la taille du fichier.
+
+Décoder le document d'un seul coup est cependant plus rapide (environ 2,5 fois avec la bibliothèque standard, 3,5 fois avec orjson
+sur un fichier de 50 Mo), mais demande plusieurs fois la taille du fichier en mémoire : le fichier est alors projeté en mémoire (mmap) et décodé
+directement depuis ses octets. Le mode "auto" (voir choisit_decodeur) décode donc en entier les fichiers de moins de TAILLE_MAX_DOCUMENT
+octets, avec le décodeur le plus rapide disponible, et garde la lecture incrémentale pour les plus gros.
+
+Les champs utilisés par analyse_entry sont lus directement dans le dictionnaire de chaque entrée (voir EntreeHAR),
+sans passer par les objets haralyzer.
+"""
+
+import json # décodeur de la bibliothèque standard
+import mmap # pour décoder le fichier sans le recopier
+import os # pour distinguer un chemin d'un fichier déjà ouvert
+import ijson # pour lire le JSON de manière incrémentale
+from ijson.common import ObjectBuilder # pour reconstruire une entrée à partir des évènements ijson
+
+
+PREFIXE_ENTREE = "log.entries.item"
+PREFIXE_PAGE = "log.pages.item"
+
+# Champs ignorés pendant la lecture : (préfixe du dictionnaire parent, clé)
+CHAMPS_IGNORES = {
+    (PREFIXE_ENTREE + ".response.content", "text"), # corps de la réponse
+    (PREFIXE_ENTREE + ".request.postData", "text"), # corps de la requete
+}
+
+
+# Décodeurs du document entier, par ordre de préférence ; "ijson" désigne la lecture incrémentale
+DECODEURS = ("orjson", "simdjson", "json")
+DECODEURS_POSSIBLES = ("auto", "ijson") + DECODEURS
+# Au-delà de cette taille, le mode "auto" lit le fichier de manière incrémentale (le document décodé occupe plusieurs fois la taille du fichier)
+TAILLE_MAX_DOCUMENT = 32 << 20
+
+
+def fonction_decodage(decodeur):
+    '''
+    Retourne la fonction de décodage d'un des DECODEURS
+        Parameters :
+            decodeur (string) : le nom du décodeur
+        Returns :
+            loads : une fonction qui décode un document JSON à partir de ses octets (bytes ou memoryview)
+        Raises :
+            ImportError : si le module du décodeur n'est pas installé
+    '''
+    if decodeur == "orjson":
+        import orjson
+        return orjson.loads # accepte directement un memoryview
+    if decodeur == "simdjson":
+        import simdjson
+        return lambda donnees: simdjson.Parser().parse(donnees, True) # True : conversion en dict/list Python
+    if decodeur == "json":
+        return lambda donnees: json.loads(str(donnees, "utf-8-sig")) # une seule copie, du tampon vers le texte
+    raise ValueError(f"Décodeur JSON inconnu : {decodeur} (décodeurs possibles : {', '.join(DECODEURS_POSSIBLES)})")
+
+
+def choisit_decodeur(decodeur="auto", taille=0):
+    '''
+    Choisit le décodeur à utiliser pour un fichier
+        Parameters :
+            decodeur (string) : un des DECODEURS_POSSIBLES ; "auto" choisit le premier décodeur de DECODEURS installé
+                (la bibliothèque standard à défaut) pour les fichiers d'au plus TAILLE_MAX_DOCUMENT octets, la lecture incrémentale sinon
+            taille (int) : la taille du fichier, en octets
+        Returns :
+            decodeur (string) : "ijson" ou un des DECODEURS
+    '''
+    if decodeur != "auto":
+        return decodeur
+    if taille > TAILLE_MAX_DOCUMENT:
+        return "ijson"
+    for nom in DECODEURS:
+        try:
+            fonction_decodage(nom)
+        except ImportError:
+            continue
+        return nom
+    return "ijson"
+
+
+def charge_document(har_file_name, decodeur="json"):
+    '''
+    Décode un fichier HAR entier
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR, ou son contenu (bytes)
+            decodeur (string) : un des DECODEURS, ou "auto"
+        Returns :
+            document (dict) : le document HAR
+    '''
+    if not isinstance(har_file_name, (str, os.PathLike)):
+        return fonction_decodage(choisit_decodeur(decodeur, len(har_file_name)))(har_file_name)
+    with open(har_file_name, 'rb') as f:
+        taille = os.fstat(f.fileno()).st_size
+        loads = fonction_decodage(choisit_decodeur(decodeur, taille))
+        if taille == 0:
+            return loads(b"") # mmap n'accepte pas les fichiers vides (le décodeur signale l'erreur)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as donnees:
+            return loads(donnees)
+
+
+def iter_entries(har_file_name, page_id=None, decodeur="auto", pages=None):
+    '''
+    Parcourt les entrées d'un fichier HAR une par une, sans charger le fichier entier en mémoire
+    Les entrées sont retournées sous forme de dictionnaires (même structure que dans le fichier HAR) privés des corps de requete/réponse.
+    Elles contiennent donc les champs utilisés par analyse_entry : serverIPAddress, request (headers pour le Host, bodySize), response (bodySize) et pageref
+        Parameters :
+            har_file_name (string) : le chemin du fichier HAR, son contenu déjà lu (bytes), ou un fichier binaire déjà ouvert (lecture incrémentale)
+            page_id (string) : si renseigné, seules les entrées dont le pageref vaut page_id sont retournées
+            decodeur (string) : un des DECODEURS_POSSIBLES (voir choisit_decodeur)
+            pages (dict) : si renseigné, complété au fil de la lecture par les pages du fichier (id -> page, voir log.pages)
+                Il n'est complet qu'à la fin du parcours (les pages peuvent se trouver après les entrées dans le fichier).
+        Yields :
+            entry (dict) : une entrée HAR
+    '''
+    if isinstance(har_file_name, (str, os.PathLike)):
+        taille = os.path.getsize(har_file_name)
+    elif isinstance(har_file_name, (bytes, bytearray, memoryview)):
+        taille = len(har_file_name)
+    else:
+        decodeur, taille = "ijson", 0 # fichier déjà ouvert
+    decodeur = choisit_decodeur(decodeur, taille)
+    if decodeur != "ijson":
+        # Document décodé en entier : les entrées sont retournées telles quelles (les corps ne sont pas retirés)
+        log = charge_document(har_file_name, decodeur)["log"]
+        if pages is not None:
+            pages.update((page.get("id"), page) for page in log.get("pages", []))
+        for entry in log["entries"]:
+            if page_id is None or entry.get("pageref") == page_id:
+                yield entry
+    elif isinstance(har_file_name, (str, os.PathLike)):
+        with open(har_file_name, 'rb') as f:
+            yield from parcourt_entrees(f, page_id, pages)
+    else:
+        yield from parcourt_entrees(har_file_name, page_id, pages) # ijson accepte aussi directement des bytes
+
+
+def parcourt_entrees(f, page_id=None, pages=None):
+    '''
+    Parcourt les entrées d'un fichier HAR ouvert en binaire (ou de son contenu) avec ijson (voir iter_entries)
+    '''
+    builder = None
+    prefixe_objet = None # PREFIXE_ENTREE ou PREFIXE_PAGE : objet en cours de construction
+    a_ignorer = 0 # profondeur restante de la valeur en cours d'ignorance (0 : rien à ignorer)
+    ignore_valeur = False
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if builder is None:
+            # On attend le début d'une nouvelle entrée (ou d'une nouvelle page, si elles sont demandées)
+            if event == 'start_map' and (prefix == PREFIXE_ENTREE or (prefix == PREFIXE_PAGE and pages is not None)):
+                prefixe_objet = prefix
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            continue
+        if ignore_valeur:
+            # Valeur d'un champ ignoré (une chaine en général, mais on gère aussi les objets/listes)
+            if event in ('start_map', 'start_array'):
+                a_ignorer += 1
+            elif event in ('end_map', 'end_array'):
+                a_ignorer -= 1
+            ignore_valeur = a_ignorer > 0
+            continue
+        if event == 'map_key' and (prefix, value) in CHAMPS_IGNORES:
+            ignore_valeur = True
+            continue
+        builder.event(event, value)
+        if prefix == prefixe_objet and event == 'end_map':
+            objet = builder.value
+            builder = None
+            if prefixe_objet == PREFIXE_PAGE:
+                pages[objet.get("id")] = objet
+            elif page_id is None or objet.get("pageref") == page_id:
+                yield objet
+
+
+def host_depuis_url(url):
+    '''
+    Retourne l'hôte (avec le port éventuel) d'une URL, c'est-à-dire la valeur de l'en-tête Host envoyé par le navigateur
+    (ex : "https://user@www.example.com:8443/chemin?q" -> "www.example.com:8443")
+        Parameters :
+            url (string) : l'URL
+        Returns :
+            host (string) : l'hôte, ou None si l'URL n'a pas de partie hôte (ex : "data:...")
+    '''
+    morceaux = url.split("/", 3)
+    if len(morceaux) < 3 or morceaux[1] != "" or not morceaux[0].endswith(":"):
+        return None
+    return morceaux[2].partition("?")[0].partition("#")[0].rpartition("@")[2] or None
+
+
+class ChampsHTTP:
+    '''
+    Champs d'une requete ou d'une réponse utilisés par analyse_entry (mêmes noms que haralyzer)
+    '''
+    __slots__ = ("host", "bodySize")
+
+    def __init__(self, host, bodySize):
+        self.host = host
+        self.bodySize = bodySize
+
+
+class EntreeHAR:
+    '''
+    Accès direct aux champs d'une entrée HAR (dictionnaire) utilisés par analyse_entry, sous les mêmes noms que haralyzer.HarEntry
+    (serverAddress, request.host, request.bodySize, response.bodySize, raw_entry), sans construire les objets haralyzer (Request, Response)
+    ni parcourir les en-tetes : l'hôte est extrait de l'URL, qui contient la même valeur que l'en-tete Host.
+    '''
+    __slots__ = ("raw_entry", "request", "response")
+
+    def __init__(self, entry):
+        '''
+        Parameters :
+            entry (dict) : l'entrée HAR
+        '''
+        self.raw_entry = entry
+        if "serverIPAddress" not in entry:
+            # Entrée ignorée par analyse_entry (voir serverAddress) : ses autres champs ne sont pas lus
+            self.request = self.response = None
+            return
+        requete = entry["request"]
+        host = host_depuis_url(requete["url"])
+        if host is None:
+            # URL sans partie hôte : on se rabat sur l'en-tete Host, comme haralyzer
+            host = next((h["value"] for h in requete["headers"] if h["name"].lower() == "host"), None)
+        self.request = ChampsHTTP(host, requete["bodySize"])
+        self.response = ChampsHTTP(None, entry["response"]["bodySize"])
+
+    @property
+    def serverAddress(self):
+        # KeyError si l'entrée n'a pas d'adresse de serveur (requete bloquée), comme haralyzer
+        return self.raw_entry["serverIPAddress"]
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation optionnelle de l'analyse, pour savoir où passe le temps d'une exécution lente
+
+Désactivée par défaut (les étapes ne coûtent alors qu'un appel de fonction, et les fonctions ne sont pas modifiées). Une fois activée :
+    - chaque étape (lecture, analyse, DataFrame, agrégations, graphes ...) est chronométrée par un gestionnaire de contexte
+    - les appels des fonctions instrumentées (géolocalisation, domaines ...) sont comptés, avec leur durée cumulée
+    - le pic de mémoire de chaque étape est mesuré avec tracemalloc (option memoire, qui ralentit l'exécution)
+    - un profil cProfile complet peut être enregistré dans un fichier (lisible avec pstats ou snakeviz)
+Un seul rapport est produit en fin d'exécution (voir Profilage.termine).
+"""
+
+import cProfile # pour le profil complet (optionnel)
+import functools # pour envelopper les fonctions instrumentées
+import os # pour identifier le processus qui enregistre le profil cProfile
+import time # pour chronométrer les étapes
+import tracemalloc # pour le pic de mémoire de chaque étape
+from contextlib import contextmanager, nullcontext
+
+
+class Profilage:
+    '''
+    Chronomètres d'étapes, compteurs d'appels et pics de mémoire d'une exécution
+    '''
+
+    def __init__(self):
+        self.actif = False
+        self.memoire = False
+        self.fichier_cprofile = None
+        self.cprofile = None
+        self.pid_cprofile = None
+        self.instrumentees = [] # (module, nom, fonction d'origine), pour les restaurer
+        self.pile = [] # pics de mémoire des étapes en cours
+        self.reinitialise()
+
+    def reinitialise(self):
+        '''
+        Efface les mesures (sans changer l'activation)
+        '''
+        self.etapes = {} # étape -> [durée cumulée (s), nombre de passages, pic de mémoire (octets)]
+        self.appels = {} # fonction -> [nombre d'appels, durée cumulée (s)]
+        self.rss_autres = 0 # pic de mémoire résidente des autres processus (voir fusionne)
+
+    def active(self, memoire=False, fichier_cprofile=None):
+        '''
+        Active les mesures
+            Parameters :
+                memoire (bool) : si True, mesure le pic de mémoire de chaque étape (tracemalloc)
+                fichier_cprofile (string) : si renseigné, un profil cProfile de l'exécution est enregistré dans ce fichier (voir termine)
+        '''
+        self.actif = True
+        self.memoire = memoire
+        if memoire and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile is not None and self.pid_cprofile != os.getpid():
+            # Processus fils (fork) : le profil cProfile hérité n'est enregistré que par le processus qui l'a démarré
+            self.cprofile.disable()
+            self.cprofile = None
+            self.fichier_cprofile = None
+        if fichier_cprofile is not None and self.cprofile is None:
+            self.fichier_cprofile = fichier_cprofile
+            self.pid_cprofile = os.getpid()
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def instrumente(self, module, noms):
+        '''
+        Remplace des fonctions d'un module par des versions qui comptent leurs appels et leur durée cumulée
+        Seuls les appels passant par le module sont comptés (pas ceux d'une copie importée avec from ... import)
+            Parameters :
+                module (module) : le module
+                noms : les noms des fonctions (ou classes) à instrumenter
+        '''
+        for nom in noms:
+            fonction = getattr(module, nom)
+            self.instrumentees.append((module, nom, fonction))
+            setattr(module, nom, self.compteur(f"{module.__name__}.{nom}", fonction))
+
+    def compteur(self, nom, fonction):
+        '''
+        Retourne une fonction qui appelle fonction en comptant ses appels (les méthodes d'un cache lru_cache restent accessibles)
+        '''
+        @functools.wraps(fonction)
+        def fonction_comptee(*args, **kwargs):
+            debut = time.perf_counter()
+            try:
+                return fonction(*args, **kwargs)
+            finally:
+                mesure = self.appels.setdefault(nom, [0, 0.0])
+                mesure[0] += 1
+                mesure[1] += time.perf_counter() - debut
+        for attribut in ("cache_info", "cache_clear"):
+            if hasattr(fonction, attribut):
+                setattr(fonction_comptee, attribut, getattr(fonction, attribut))
+        return fonction_comptee
+
+    def etape(self, nom):
+        '''
+        Gestionnaire de contexte qui chronomètre une étape (sans effet si les mesures ne sont pas activées)
+        Les étapes peuvent être imbriquées : la durée et le pic de mémoire d'une étape incluent ceux des étapes qu'elle contient
+            Parameters :
+                nom (string) : le nom de l'étape
+        '''
+        if not self.actif:
+            return nullcontext()
+        return self.mesure_etape(nom)
+
+    @contextmanager
+    def mesure_etape(self, nom):
+        if self.memoire:
+            self.debut_pic()
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            pic = self.fin_pic() if self.memoire else 0
+            self.ajoute_etape(nom, time.perf_counter() - debut, pic)
+
+    def debut_pic(self):
+        # Le pic atteint jusqu'ici appartient à l'étape englobante : il lui est attribué avant de remettre le pic à zéro
+        if self.pile:
+            self.pile[-1] = max(self.pile[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.pile.append(0)
+
+    def fin_pic(self):
+        pic = max(self.pile.pop(), tracemalloc.get_traced_memory()[1])
+        if self.pile:
+            self.pile[-1] = max(self.pile[-1], pic)
+        return pic
+
+    def ajoute_etape(self, nom, duree, pic=0, passages=1):
+        mesure = self.etapes.setdefault(nom, [0.0, 0, 0])
+        mesure[0] += duree
+        mesure[1] += passages
+        mesure[2] = max(mesure[2], pic)
+
+    def itere(self, nom, iterable):
+        '''
+        Parcourt un itérable en chronométrant le temps passé à produire ses éléments (par exemple la lecture des entrées d'un fichier HAR,
+        qui est entremêlée avec leur analyse). Retourne l'itérable lui-même si les mesures ne sont pas activées.
+            Parameters :
+                nom (string) : le nom de l'étape
+                iterable : l'itérable
+        '''
+        if not self.actif:
+            return iterable
+        return self.itere_chronometre(nom, iterable)
+
+    def itere_chronometre(self, nom, iterable):
+        iterateur = iter(iterable)
+        duree = 0.0
+        try:
+            while True:
+                debut = time.perf_counter()
+                try:
+                    element = next(iterateur)
+                except StopIteration:
+                    break
+                finally:
+                    duree += time.perf_counter() - debut
+                yield element
+        finally:
+            self.ajoute_etape(nom, duree)
+
+    def releve(self):
+        '''
+        Retourne les mesures sous une forme transmissible d'un processus à l'autre (voir fusionne)
+        '''
+        return {"etapes" : self.etapes, "appels" : self.appels, "rss" : pic_rss()}
+
+    def fusionne(self, releve):
+        '''
+        Ajoute les mesures d'un autre processus (durées et appels additionnés, pics de mémoire : le maximum)
+            Parameters :
+                releve (dict) : les mesures, obtenues avec releve
+        '''
+        for nom, (duree, passages, pic) in releve["etapes"].items():
+            self.ajoute_etape(nom, duree, pic, passages)
+        for nom, (nb, duree) in releve["appels"].items():
+            mesure = self.appels.setdefault(nom, [0, 0.0])
+            mesure[0] += nb
+            mesure[1] += duree
+        self.rss_autres = max(self.rss_autres, releve["rss"] or 0)
+
+    def rapport(self):
+        '''
+        Retourne le rapport des mesures (texte)
+        '''
+        lignes = ["===== Profilage ====="]
+        lignes.append(f"{'Etape':<32}{'durée (s)':>12}{'passages':>10}" + (f"{'pic mémoire (Mo)':>18}" if self.memoire else ""))
+        for nom, (duree, passages, pic) in self.etapes.items():
+            lignes.append(f"{nom:<32}{duree:>12.3f}{passages:>10}" + (f"{pic / 1e6:>18.1f}" if self.memoire else ""))
+        if self.appels:
+            lignes.append(f"{'Fonction (durée incluant les appels imbriqués)':<52}{'appels':>10}{'durée (s)':>12}")
+            for nom, (nb, duree) in sorted(self.appels.items(), key=lambda a: -a[1][1]):
+                lignes.append(f"{nom:<52}{nb:>10}{duree:>12.3f}")
+        rss = max(pic_rss() or 0, self.rss_autres)
+        if rss:
+            lignes.append(f"Pic de mémoire résidente (RSS) : {rss / 1e6:.1f} Mo")
+        if self.fichier_cprofile is not None:
+            lignes.append(f"Profil cProfile enregistré dans {self.fichier_cprofile} (python -m pstats {self.fichier_cprofile})")
+        return "\n".join(lignes)
+
+    def termine(self):
+        '''
+        Arrête les mesures, enregistre le profil cProfile s'il a été demandé, restaure les fonctions instrumentées et retourne le rapport
+            Returns :
+                rapport (string) : le rapport de fin d'exécution
+        '''
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.fichier_cprofile)
+            self.cprofile = None
+        for module, nom, fonction in reversed(self.instrumentees):
+            setattr(module, nom, fonction)
+        self.instrumentees = []
+        rapport = self.rapport()
+        if self.memoire and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.actif = False
+        return rapport
+
+
+def pic_rss():
+    '''
+    Retourne le pic de mémoire résidente du processus en octets (None si le module resource n'est pas disponible, par exemple sous Windows)
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # en Ko sous Linux
+
+
+# Instance partagée par les modules de l'analyse
+profil = Profilage()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Service d'analyse de fichiers HAR : un processus qui reste lancé et répond aux requetes HTTP (sur un port local ou une socket Unix)
+
+Chaque exécution de analyse_fichier_HAR.py paie l'import de pandas, l'ouverture des bases IP2Location et le chargement
+de la Public Suffix List avant d'analyser la première entrée. Le service fait ce travail une seule fois : ses processus d'analyse
+sont préchauffés au démarrage (voir prechauffe), puis gardent leurs caches (adresses IP, domaines, résultats par fichier) d'une requete à l'autre.
+
+Requetes :
+    POST /analyse[?page=<page_id>]        corps : le contenu d'un fichier HAR
+    GET  /analyse?chemin=<fichier>[&page=<page_id>]   fichier HAR de --racine lu par le service (refusé si --racine n'est pas renseigné)
+    GET  /etat                            processus, requetes en cours, compteurs et efficacité des caches de géolocalisation
+La réponse d'une analyse est le JSON des agrégats (le même que la sortie json de process_data, voir Agregats.to_dict).
+Au plus nb_processus analyses sont en cours, et au plus --attente requetes attendent une place : au-delà, le service répond 503
+(avec Retry-After). Le corps d'une requete POST (au plus --taille-max octets) est recopié par blocs dans un fichier temporaire,
+dont seul le chemin est transmis au processus d'analyse : la mémoire utilisée ne dépend pas de la taille des fichiers reçus.
+
+Utilisation : python service.py [--port 8765 | --socket /tmp/analyse_har.sock] [-j nb_processus] [--attente n] [--taille-max octets] [--decodeur auto|ijson|orjson|simdjson|json] [--cache fichier | --sans-cache] [--racine répertoire] [-v | -q]
+Exemples de clients :
+    curl --data-binary @page.har http://127.0.0.1:8765/analyse
+    curl --unix-socket /tmp/analyse_har.sock "http://localhost/analyse?chemin=page.har"   (service lancé avec --racine /crawl)
+"""
+
+import argparse # pour les arguments de la ligne de commande
+import json # pour les réponses
+import logging # pour les messages de diagnostic
+import os # pour les chemins et le nombre de coeurs
+import signal # pour arreter proprement le service (SIGTERM)
+import socketserver # pour le serveur sur socket Unix
+import tempfile # pour recopier le corps des requetes sur le disque
+import threading # pour limiter le nombre de requetes acceptées
+from concurrent.futures import ProcessPoolExecutor # processus d'analyse préchauffés
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # serveur HTTP de la bibliothèque standard
+from urllib.parse import parse_qs, urlsplit # pour lire les paramètres des requetes
+
+import analyse_fichier_HAR as analyse # fonctions d'analyse d'un fichier HAR
+import table_echanges # pour préchauffer pandas sur une table minimale
+from agregation import calcule_agregats # agrégats par pays et par domaine
+from cache_resultats import CacheResultats, cle_fichier, version_outils # pour ne pas ré-analyser un fichier déjà reçu
+from corpus import FICHIER_CACHE_RESULTATS, decrit_erreur
+from lecture_har import DECODEURS_POSSIBLES # décodeurs JSON des fichiers HAR
+
+
+logger = logging.getLogger("service_har")
+
+PORT = 8765
+HOTE = "127.0.0.1" # le service n'est accessible que depuis la machine locale
+# Nombre de requetes qui peuvent attendre une place quand tous les processus d'analyse sont occupés
+NB_EN_ATTENTE = 8
+# Délai conseillé aux clients (en secondes) avant de renvoyer une requete refusée
+DELAI_NOUVEL_ESSAI = 1
+# Taille maximale (en octets) d'un fichier HAR envoyé en POST
+TAILLE_MAX_REQUETE = 64 << 20
+# Taille des blocs lus dans le corps d'une requete
+TAILLE_BLOC = 1 << 20
+
+# Etat d'un processus d'analyse (voir prechauffe)
+cache_processus = None # cache des résultats par fichier, avec sa connexion ouverte
+version_processus = None # version des outils (clés du cache)
+
+
+class ServiceSature(Exception):
+    '''
+    Levée quand le service a déjà accepté le nombre maximum de requetes
+    '''
+
+
+def prechauffe(fichier_cache, version, decodeur=None):
+    '''
+    Prépare un processus d'analyse une fois pour toutes (initialisation du ProcessPoolExecutor) : ouverture des bases IP2Location
+    (et de l'index en mémoire s'il est utilisé), chargement de la Public Suffix List, des connexions aux caches et des chemins de code de pandas
+        Parameters :
+            fichier_cache (string) : le fichier du cache des résultats, ou None pour ne pas l'utiliser
+            version (string) : la version des outils (voir cache_resultats.version_outils)
+            decodeur (string) : le décodeur JSON des fichiers HAR (voir analyse.DECODEUR_HAR), None pour celui par défaut
+    '''
+    global cache_processus, version_processus
+    if decodeur is not None:
+        analyse.DECODEUR_HAR = decodeur
+    for famille in analyse.FICHIERS_IP2LOCATION:
+        analyse.get_base_ip2location(famille)
+        if analyse.indexIP is not None:
+            analyse.indexIP.get_plages(famille)
+    analyse.get_tld_and_2nd_lvl_domain("www.example.com")
+    exemple = table_echanges.from_rows([["www.example.com", "com", "example.com", 0, 0, "-"]])
+    calcule_agregats(exemple.to_dataframe())
+    if analyse.cacheGeoloc is not None:
+        analyse.cacheGeoloc.connecte()
+    cache_processus = CacheResultats(fichier_cache) if fichier_cache else None
+    version_processus = version
+    if cache_processus is not None:
+        cache_processus.connecte()
+
+
+def analyse_requete(chemin, page_id=None):
+    '''
+    Analyse un fichier HAR dans un processus d'analyse ; les agrégats d'un fichier déjà analysé sont relus dans le cache des résultats
+        Parameters :
+            chemin (string) : le chemin du fichier HAR (fichier du serveur, ou corps d'une requete POST copié dans un fichier temporaire)
+            page_id (string) : la page à analyser, ou None pour toutes les entrées
+        Returns :
+            resultats (dict) : les agrégats (voir Agregats.to_dict)
+            en_cache (bool) : True si les agrégats ont été relus dans le cache
+            stats_ip (dict) : l'efficacité du cache de géolocalisation du processus (voir analyse.stats_cache_ip)
+    '''
+    cle = None
+    if cache_processus is not None:
+        cle = cle_fichier(chemin, version_processus, page_id)
+        agregats = cache_processus.get(cle)
+        if agregats is not None:
+            return agregats.to_dict(), True, analyse.stats_cache_ip()
+    my_data = analyse.analyse_har_file(chemin, page_id)
+    agregats = calcule_agregats(my_data.to_dataframe())
+    if cache_processus is not None:
+        cache_processus.ajoute(cle, agregats)
+    return agregats.to_dict(), False, analyse.stats_cache_ip()
+
+
+class ServiceAnalyse:
+    '''
+    Processus d'analyse préchauffés et limitation du nombre de requetes acceptées
+    '''
+
+    def __init__(self, nb_processus=None, nb_en_attente=NB_EN_ATTENTE, fichier_cache=FICHIER_CACHE_RESULTATS, racine=None,
+                 taille_max=TAILLE_MAX_REQUETE, decodeur=None):
+        '''
+        Parameters :
+            nb_processus (int) : le nombre de processus d'analyse (par défaut, le nombre de coeurs)
+            nb_en_attente (int) : le nombre de requetes qui peuvent attendre une place (voir NB_EN_ATTENTE)
+            fichier_cache (string) : le fichier du cache des résultats, ou None pour tout ré-analyser
+            racine (string) : le répertoire des fichiers qui peuvent etre analysés par leur chemin (None : analyse par chemin refusée)
+            taille_max (int) : la taille maximale (en octets) d'un fichier HAR envoyé en POST
+            decodeur (string) : le décodeur JSON des fichiers HAR (voir analyse.DECODEUR_HAR), None pour celui par défaut
+        '''
+        self.nb_processus = nb_processus or os.cpu_count() or 1
+        self.taille_max = taille_max
+        self.capacite = self.nb_processus + nb_en_attente
+        self.places = threading.BoundedSemaphore(self.capacite)
+        self.racine = os.path.realpath(racine) if racine else None
+        self.verrou = threading.Lock()
+        self.en_cours = 0
+        self.compteurs = {"analysees" : 0, "en_cache" : 0, "refusees" : 0, "erreurs" : 0}
+        self.stats_ip = {} # pid -> dernière efficacité du cache de géolocalisation de chaque processus d'analyse
+        version = version_outils(analyse.FICHIERS_IP2LOCATION.values()) if fichier_cache else None
+        self.pool = ProcessPoolExecutor(max_workers=self.nb_processus, initializer=prechauffe, initargs=(fichier_cache, version, decodeur))
+        # Tous les processus sont créés (fork) et préchauffés dès la première tache, avant que le serveur ne lance ses threads
+        self.pool.submit(int).result()
+
+    @contextmanager
+    def place(self):
+        '''
+        Gestionnaire de contexte qui réserve une place pour une requete, ou lève ServiceSature si le service est saturé
+        (la place est réservée avant de lire le corps de la requete, pour ne pas accumuler les fichiers en mémoire)
+        '''
+        if not self.places.acquire(blocking=False):
+            self.compte("refusees")
+            raise ServiceSature()
+        try:
+            yield
+        finally:
+            self.places.release()
+
+    def analyse(self, chemin, page_id=None):
+        '''
+        Analyse un fichier HAR dans un des processus d'analyse (à appeler dans le contexte de place)
+            Parameters :
+                chemin (string) : le chemin du fichier HAR (voir analyse_requete)
+                page_id (string) : la page à analyser, ou None pour toutes les entrées
+            Returns :
+                resultats (dict) : les agrégats (voir Agregats.to_dict)
+                en_cache (bool) : True si les agrégats ont été relus dans le cache
+        '''
+        with self.verrou:
+            self.en_cours += 1
+        try:
+            resultats, en_cache, stats_ip = self.pool.submit(analyse_requete, chemin, page_id).result()
+        except Exception:
+            self.compte("erreurs")
+            raise
+        finally:
+            with self.verrou:
+                self.en_cours -= 1
+        with self.verrou:
+            self.stats_ip[stats_ip["pid"]] = analyse.plus_recentes(self.stats_ip.get(stats_ip["pid"]), stats_ip)
+        self.compte("en_cache" if en_cache else "analysees")
+        return resultats, en_cache
+
+    def compte(self, compteur):
+        with self.verrou:
+            self.compteurs[compteur] += 1
+
+    def chemin_autorise(self, chemin):
+        '''
+        Retourne le chemin d'un fichier à analyser (relatif à la racine)
+        Lève PermissionError si la racine n'est pas renseignée ou si le fichier n'est pas dans la racine
+        '''
+        if self.racine is None:
+            raise PermissionError("Analyse par chemin désactivée (service lancé sans --racine)")
+        chemin = os.path.realpath(os.path.join(self.racine, chemin))
+        if os.path.commonpath([self.racine, chemin]) != self.racine:
+            raise PermissionError(f"{chemin} n'est pas dans {self.racine}")
+        return chemin
+
+    def etat(self):
+        '''
+        Retourne l'état du service (sérialisable en JSON)
+        '''
+        with self.verrou:
+            return {"processus" : self.nb_processus, "capacite" : self.capacite, "en_cours" : self.en_cours, **self.compteurs,
+                    "cache_ip" : analyse.cumule_stats_cache_ip(self.stats_ip.values())}
+
+    def ferme(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class GestionnaireRequetes(BaseHTTPRequestHandler):
+    '''
+    Traitement des requetes HTTP du service (un thread par connexion, voir cree_serveur)
+    '''
+    server_version = "AnalyseHAR/1.0"
+    protocol_version = "HTTP/1.1" # connexions persistantes : un client peut envoyer plusieurs fichiers sans se reconnecter
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parametres = parse_qs(url.query)
+        if url.path == "/etat":
+            self.repond(200, self.server.service.etat())
+        elif url.path == "/analyse":
+            self.traite_analyse(parametres, lit_corps=False)
+        else:
+            self.repond(404, {"erreur" : f"Ressource inconnue : {url.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == "/analyse":
+            self.traite_analyse(parse_qs(url.query), lit_corps=True)
+        else:
+            self.close_connection = True # corps non lu
+            self.repond(404, {"erreur" : f"Ressource inconnue : {url.path}"})
+
+    def traite_analyse(self, parametres, lit_corps):
+        '''
+        Analyse le fichier désigné par le paramètre chemin, ou à défaut celui contenu dans le corps de la requete (POST)
+        '''
+        service = self.server.service
+        chemin = parametres.get("chemin", [None])[0]
+        page_id = parametres.get("page", [None])[0]
+        if lit_corps and chemin is not None:
+            self.close_connection = True # corps ignoré
+            lit_corps = False
+        try:
+            with service.place():
+                if chemin is not None:
+                    resultats, en_cache = service.analyse(service.chemin_autorise(chemin), page_id)
+                elif not lit_corps:
+                    self.repond(400, {"erreur" : "Paramètre chemin manquant (ou fichier HAR à envoyer en POST)"})
+                    return
+                else:
+                    with self.corps_temporaire(service.taille_max) as source:
+                        if source is None:
+                            return
+                        resultats, en_cache = service.analyse(source, page_id)
+        except ServiceSature:
+            if lit_corps:
+                self.close_connection = True
+            self.repond(503, {"erreur" : "Service saturé, réessayer plus tard"}, {"Retry-After" : str(DELAI_NOUVEL_ESSAI)})
+            return
+        except FileNotFoundError as e:
+            self.repond(404, {"erreur" : decrit_erreur(e)})
+            return
+        except PermissionError as e:
+            self.repond(403, {"erreur" : decrit_erreur(e)})
+            return
+        except BrokenProcessPool as e:
+            self.repond(500, {"erreur" : decrit_erreur(e)})
+            return
+        except Exception as e: # fichier HAR invalide
+            self.repond(422, {"erreur" : decrit_erreur(e)})
+            return
+        self.repond(200, resultats, {"X-Cache-Resultats" : "oui" if en_cache else "non"})
+
+    @contextmanager
+    def corps_temporaire(self, taille_max):
+        '''
+        Gestionnaire de contexte qui recopie le corps de la requete par blocs dans un fichier temporaire (supprimé à la sortie)
+        et donne son chemin, ou None si la réponse d'erreur a déjà été envoyée (taille absente ou trop grande, corps incomplet)
+        '''
+        taille = self.headers.get("Content-Length")
+        if taille is None or not taille.isdigit():
+            self.close_connection = True
+            self.repond(411, {"erreur" : "En-tete Content-Length manquant"})
+            yield None
+            return
+        reste = int(taille)
+        if reste > taille_max:
+            self.close_connection = True
+            self.repond(413, {"erreur" : f"Fichier HAR trop gros (maximum : {taille_max} octets)"})
+            yield None
+            return
+        descripteur, chemin = tempfile.mkstemp(prefix="requete_", suffix=".har")
+        try:
+            with os.fdopen(descripteur, 'wb') as f:
+                while reste > 0:
+                    bloc = self.rfile.read(min(reste, TAILLE_BLOC))
+                    if not bloc:
+                        break
+                    f.write(bloc)
+                    reste -= len(bloc)
+            if reste > 0:
+                self.close_connection = True
+                self.repond(400, {"erreur" : "Corps de la requete incomplet"})
+                yield None
+            else:
+                yield chemin
+        finally:
+            os.remove(chemin)
+
+    def repond(self, code, contenu, entetes=None):
+        corps = json.dumps(contenu).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(corps)))
+        for nom, valeur in (entetes or {}).items():
+            self.send_header(nom, valeur)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def address_string(self):
+        # Sur une socket Unix, le client n'a pas d'adresse
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "socket unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class ServeurUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    Serveur HTTP sur une socket Unix (un thread par connexion)
+    '''
+    daemon_threads = True
+
+
+def cree_serveur(service, socket_unix=None, hote=HOTE, port=PORT):
+    '''
+    Crée le serveur HTTP du service, sur une socket Unix si elle est renseignée, sur hote:port sinon
+        Parameters :
+            service (ServiceAnalyse) : le service qui traite les analyses
+            socket_unix (string) : le chemin de la socket Unix
+            hote (string), port (int) : l'adresse d'écoute en TCP
+        Returns :
+            serveur : le serveur (à lancer avec serve_forever)
+    '''
+    if socket_unix is not None:
+        if os.path.exists(socket_unix):
+            os.remove(socket_unix) # socket laissée par un service arreté
+        serveur = ServeurUnix(socket_unix, GestionnaireRequetes)
+    else:
+        serveur = ThreadingHTTPServer((hote, port), GestionnaireRequetes)
+    serveur.service = service
+    return serveur
+
+
+def arrete(signum, frame):
+    raise SystemExit(0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service d'analyse de fichiers HAR (HTTP sur un port local ou une socket Unix)")
+    parser.add_argument("--port", type=int, default=PORT, help=f"port TCP (défaut : {PORT})")
+    parser.add_argument("--hote", default=HOTE, help=f"adresse d'écoute TCP (défaut : {HOTE})")
+    parser.add_argument("--socket", default=None, help="socket Unix sur laquelle écouter (à la place du port TCP)")
+    parser.add_argument("-j", "--processus", type=int, default=None, help="nombre de processus d'analyse (défaut : nombre de coeurs)")
+    parser.add_argument("--attente", type=int, default=NB_EN_ATTENTE, help=f"nombre de requetes en attente au-delà desquelles le service répond 503 (défaut : {NB_EN_ATTENTE})")
+    parser.add_argument("--taille-max", type=int, default=TAILLE_MAX_REQUETE, help=f"taille maximale en octets d'un fichier HAR envoyé en POST (défaut : {TAILLE_MAX_REQUETE})")
+    parser.add_argument("--decodeur", choices=DECODEURS_POSSIBLES, default=analyse.DECODEUR_HAR, help=f"décodeur JSON des fichiers HAR (défaut : {analyse.DECODEUR_HAR})")
+    parser.add_argument("--cache", default=FICHIER_CACHE_RESULTATS, help=f"fichier du cache des résultats (défaut : {FICHIER_CACHE_RESULTATS})")
+    parser.add_argument("--sans-cache", action="store_true", help="ré-analyse chaque fichier reçu sans utiliser le cache")
+    parser.add_argument("--racine", default=None, help="répertoire des fichiers analysables par leur chemin (GET /analyse?chemin=), désactivé par défaut")
+    parser.add_argument("-v", "--verbeux", action="store_true", help="affiche chaque requete et le détail de chaque entrée analysée")
+    parser.add_argument("-q", "--silencieux", action="store_true", help="n'affiche pas le bilan de chaque fichier")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbeux else logging.WARNING if args.silencieux else logging.INFO, format="%(message)s")
+
+    service = ServiceAnalyse(args.processus, args.attente, None if args.sans_cache else args.cache, args.racine, args.taille_max, args.decodeur)
+    serveur = cree_serveur(service, args.socket, args.hote, args.port)
+    signal.signal(signal.SIGTERM, arrete)
+    logger.warning("Service prêt sur %s (%d processus d'analyse)", args.socket or f"http://{args.hote}:{args.port}", service.nb_processus)
+    try:
+        serveur.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serveur.server_close()
+        service.ferme()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
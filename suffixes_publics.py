@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Domaine enregistrable (eTLD+1) d'un hostname à partir de la Public Suffix List
+
+Prendre les deux derniers labels d'un hostname ne suffit pas : www.sydney.edu.au donnerait edu.au, et tous les sites en .co.uk
+se retrouveraient dans le même domaine. On utilise donc la Public Suffix List (https://publicsuffix.org), dont une copie est fournie
+avec le programme (public_suffix_list.dat) : aucun accès réseau n'est nécessaire.
+
+Les règles sont compilées dans un arbre (trie) indexé par les labels en partant de la droite (au -> edu -> ...), si bien qu'une recherche
+coûte un accès par label du hostname. L'arbre compilé est sauvegardé (pickle) à côté de la liste pour ne pas relire le texte à chaque lancement.
+"""
+
+import ipaddress # pour reconnaitre les hostnames qui sont des adresses IP
+import os # pour les chemins et dates de modification des fichiers
+import pickle # pour sauvegarder l'arbre compilé
+
+
+REPERTOIRE = os.path.dirname(os.path.abspath(__file__))
+FICHIER_LISTE = os.path.join(REPERTOIRE, "public_suffix_list.dat")
+FICHIER_ARBRE = os.path.join(REPERTOIRE, "public_suffix_list.pickle")
+
+# Clés particulières des noeuds de l'arbre
+FIN = ""  # une règle se termine sur ce noeud
+EXCEPTION = "!"  # règle d'exception (ex : !www.ck)
+
+
+def lire_regles(chemin=FICHIER_LISTE, prives=False):
+    '''
+    Lit les règles de la Public Suffix List
+        Parameters :
+            chemin (string) : le fichier de la liste
+            prives (bool) : si True, les domaines privés (github.io, blogspot.com ...) sont aussi considérés comme des suffixes publics
+        Returns :
+            regles (list) : la liste des règles (ex : "co.uk", "*.ck", "!www.ck")
+    '''
+    regles = []
+    with open(chemin, 'r', encoding="utf-8") as f:
+        for ligne in f:
+            ligne = ligne.strip()
+            if ligne.startswith("// ===BEGIN PRIVATE DOMAINS===") and not prives:
+                break
+            if ligne and not ligne.startswith("//"):
+                regles.append(ligne.split()[0].lower())
+    return regles
+
+
+def compiler_arbre(regles):
+    '''
+    Construit l'arbre des suffixes publics, indexé par les labels lus de droite à gauche
+        Parameters :
+            regles (list) : les règles de la Public Suffix List
+        Returns :
+            arbre (dict) : l'arbre, chaque noeud étant un dictionnaire label -> noeud fils
+    '''
+    arbre = {}
+    for regle in regles:
+        exception = regle.startswith("!")
+        noeud = arbre
+        for label in reversed(regle.lstrip("!").split('.')):
+            noeud = noeud.setdefault(label, {})
+        noeud[EXCEPTION if exception else FIN] = True
+    return arbre
+
+
+def charger_arbre(prives=False):
+    '''
+    Charge l'arbre compilé s'il est à jour, sinon le recompile à partir de la liste et le sauvegarde
+        Parameters :
+            prives (bool) : prise en compte des domaines privés (voir lire_regles)
+        Returns :
+            arbre (dict) : l'arbre des suffixes publics
+    '''
+    date_liste = os.path.getmtime(FICHIER_LISTE)
+    try:
+        if os.path.getmtime(FICHIER_ARBRE) >= date_liste:
+            with open(FICHIER_ARBRE, 'rb') as f:
+                arbres = pickle.load(f)
+            if prives in arbres:
+                return arbres[prives]
+        else:
+            arbres = {}
+    except (OSError, pickle.UnpicklingError, EOFError):
+        arbres = {}
+    arbres[prives] = compiler_arbre(lire_regles(FICHIER_LISTE, prives))
+    try:
+        with open(FICHIER_ARBRE, 'wb') as f:
+            pickle.dump(arbres, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass # répertoire en lecture seule : l'arbre sera recompilé au prochain lancement
+    return arbres[prives]
+
+
+def version_liste(chemin=FICHIER_LISTE):
+    '''
+    Retourne la version de la Public Suffix List fournie (ligne "// VERSION: ..." de l'entête)
+        Parameters :
+            chemin (string) : le fichier de la liste
+        Returns :
+            version (string) : la version, ou "" si elle n'est pas indiquée
+    '''
+    with open(chemin, 'r', encoding="utf-8") as f:
+        for ligne in f:
+            if ligne.startswith("// VERSION:"):
+                return ligne.split(":", 1)[1].strip()
+            if ligne.strip() and not ligne.startswith("//"):
+                break
+    return ""
+
+
+arbre_suffixes = None
+
+
+def get_public_suffix_length(labels):
+    '''
+    Retourne le nombre de labels du suffixe public d'un hostname
+        Parameters :
+            labels (list) : les labels du hostname (ex : ['www', 'sydney', 'edu', 'au'])
+        Returns :
+            longueur (int) : le nombre de labels du suffixe public (ex : 2 pour edu.au)
+    '''
+    global arbre_suffixes
+    if arbre_suffixes is None:
+        arbre_suffixes = charger_arbre()
+    longueur = 1 # règle par défaut "*" : le TLD est toujours un suffixe public
+    noeud = arbre_suffixes
+    for i, label in enumerate(reversed(labels)):
+        joker = noeud.get("*")
+        fils = noeud.get(label)
+        if fils is not None and EXCEPTION in fils:
+            # Une exception l'emporte sur les autres règles : le suffixe s'arrête au label précédent
+            return i
+        if (fils is not None and FIN in fils) or (joker is not None and FIN in joker):
+            longueur = i + 1
+        noeud = fils if fils is not None else joker
+        if noeud is None:
+            break
+    return longueur
+
+
+def retire_port(host):
+    '''
+    Retourne le nom d'un hôte sans son port ni les crochets d'une adresse IPV6
+    (ex : "www.example.co.uk:8443" -> "www.example.co.uk", "[2001:db8::1]:443" -> "2001:db8::1")
+        Parameters :
+            host (string) : l'hôte, tel que dans l'en-tete Host
+        Returns :
+            nom (string) : le nom de l'hôte
+    '''
+    if host.startswith('['):
+        return host[1:].partition(']')[0]
+    nom, separateur, port = host.rpartition(':')
+    if separateur and port.isdigit() and ':' not in nom:
+        return nom
+    return host # pas de port, ou adresse IPV6 sans crochets
+
+
+def get_registrable_domain(hostname):
+    '''
+    Retourne le domaine enregistrable (suffixe public + un label) d'un hostname
+        Parameters :
+            hostname (string) : le hostname (ex : www.sydney.edu.au), avec éventuellement un port (voir retire_port)
+        Returns :
+            domain (string) : le domaine enregistrable (ex : sydney.edu.au), ou le hostname lui-même (sans port) s'il s'agit d'un suffixe public ou d'une adresse IP
+    '''
+    hostname = retire_port(hostname)
+    try:
+        ipaddress.ip_address(hostname)
+        return hostname
+    except ValueError:
+        pass
+    labels = hostname.lower().rstrip('.').split('.')
+    longueur = get_public_suffix_length(labels)
+    return '.'.join(labels[-(longueur + 1):])
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Table des échanges réseau construite colonne par colonne
+
+Plutot que d'accumuler une liste de listes puis de passer par np.array (qui convertit tout en chaines, y compris les tailles,
+avant de les reconvertir en int64), chaque échange est rangé directement dans des colonnes typées :
+    - les tailles dans des tableaux d'entiers 64 bits, les durées dans des tableaux de réels
+    - les chaines (hostname, tld, domain, country, page) sous forme de codes entiers, chaque valeur distincte n'étant stockée qu'une fois
+      (dans un Vocabulaire, qui peut etre partagé entre colonnes et entre tables, voir vocabulaires_partages)
+Le DataFrame est ensuite construit sans conversion à partir de ces colonnes.
+"""
+
+from array import array # tableaux typés extensibles
+import numpy as np # pour l'analyse de données
+import pandas as pd # pour l'analyse de données
+
+from tailles import COLONNES_TAILLES, composantes_tailles # composantes des tailles transférées
+
+
+# Colonnes produites par analyse_entry
+COLONNES = ['hostname', 'tld', 'domain', 'requestSize', 'responseSize', 'country']
+# Décomposition de la durée d'un échange (entry.timings, en ms)
+TIMINGS = ['blocked', 'dns', 'connect', 'ssl', 'send', 'wait', 'receive']
+# Colonnes complémentaires décrivant l'entrée HAR (voir infos_entree)
+COLONNES_ENTREE = ['page', 'startedDateTime', 'time'] + TIMINGS + COLONNES_TAILLES
+COLONNES_TABLE = COLONNES + COLONNES_ENTREE
+# Colonnes décrivant la page de chaque échange (début de la page et pageTimings.onLoad en ms), ajoutées par to_dataframe
+COLONNES_PAGE = ['pageStartedDateTime', 'onLoad']
+
+# Type de stockage de chaque colonne
+TYPES_COLONNES = {
+    'hostname' : 'categorie', 'tld' : 'categorie', 'domain' : 'categorie', 'country' : 'categorie', 'page' : 'categorie',
+    'requestSize' : 'entier', 'responseSize' : 'entier',
+    'time' : 'reel', **{nom : 'reel' for nom in TIMINGS + COLONNES_TAILLES},
+    'startedDateTime' : 'date',
+}
+# Valeur utilisée quand une ligne ne renseigne pas une colonne (ex : liste 2D sans les colonnes de COLONNES_ENTREE)
+VALEURS_DEFAUT = {'categorie' : "", 'entier' : 0, 'reel' : float('nan'), 'date' : None}
+
+# Formats d'export de la table (voir exporte_echanges)
+FORMATS_EXPORT = ("parquet", "feather")
+
+
+def duree(valeur):
+    '''
+    Retourne une durée HAR en ms, ou NaN si elle est absente ou vaut -1 (étape sans objet, ex : connexion réutilisée)
+    '''
+    return valeur if valeur is not None and valeur >= 0 else float('nan')
+
+
+def infos_entree(entry):
+    '''
+    Retourne les valeurs des colonnes de COLONNES_ENTREE pour une entrée HAR
+        Parameters :
+            entry (dict) : l'entrée HAR
+        Returns :
+            infos (list) : page (pageref), date de début et durée totale (ms) de l'échange, sa décomposition (TIMINGS, en ms)
+                puis les composantes de ses tailles (COLONNES_TAILLES, en octets)
+    '''
+    timings = entry.get("timings", {})
+    return ([entry.get("pageref", "unknown"), entry.get("startedDateTime"), duree(entry.get("time"))]
+            + [duree(timings.get(nom)) for nom in TIMINGS] + composantes_tailles(entry))
+
+
+def infos_page(page):
+    '''
+    Retourne les valeurs des colonnes de COLONNES_PAGE pour une page HAR
+        Parameters :
+            page (dict) : la page HAR (élément de log.pages)
+        Returns :
+            infos (tuple) : date de début de la page et durée jusqu'à l'évènement onLoad (ms, NaN si inconnue)
+    '''
+    return page.get("startedDateTime"), duree(page.get("pageTimings", {}).get("onLoad"))
+
+
+class Vocabulaire:
+    '''
+    Dictionnaire des chaines distinctes d'une ou plusieurs colonnes : chaque valeur n'est stockée qu'une fois et reçoit un code entier
+    '''
+
+    def __init__(self):
+        self.codes = {} # valeur -> code
+        self.valeurs = [] # code -> valeur
+
+    def __len__(self):
+        return len(self.valeurs)
+
+    def code(self, valeur):
+        '''
+        Retourne le code d'une valeur, en l'ajoutant au vocabulaire si elle est nouvelle
+        '''
+        code = self.codes.get(valeur)
+        if code is None:
+            code = self.codes[valeur] = len(self.valeurs)
+            self.valeurs.append(valeur)
+        return code
+
+
+def vocabulaires_partages():
+    '''
+    Retourne des vocabulaires à partager entre plusieurs tables (par exemple les tables des pages d'un meme fichier) :
+    hostname, tld et domain partagent le meme vocabulaire (un domaine est le plus souvent aussi un hostname)
+        Returns :
+            vocabulaires (dict) : colonne -> Vocabulaire, pour les colonnes 'categorie' de TYPES_COLONNES
+    '''
+    noms = Vocabulaire()
+    return {'hostname' : noms, 'tld' : noms, 'domain' : noms, 'country' : Vocabulaire(), 'page' : Vocabulaire()}
+
+
+class ColonneCategorielle:
+    '''
+    Colonne de chaines stockée sous forme de codes entiers et d'un vocabulaire des valeurs distinctes
+    '''
+
+    def __init__(self, vocabulaire=None):
+        '''
+        Parameters :
+            vocabulaire (Vocabulaire) : un vocabulaire partagé avec d'autres colonnes, ou None pour un vocabulaire propre à la colonne
+        '''
+        self.codes = array('i')
+        self.partage = vocabulaire is not None
+        self.vocabulaire = Vocabulaire() if vocabulaire is None else vocabulaire
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, valeur):
+        '''
+        Ajoute une valeur à la fin de la colonne
+            Parameters :
+                valeur (string) : la valeur
+        '''
+        code = self.vocabulaire.codes.get(valeur) # cas le plus fréquent : valeur déjà rencontrée, sans appel de méthode
+        if code is None:
+            code = self.vocabulaire.code(valeur)
+        self.codes.append(code)
+
+    def remplace_valeurs(self, correspondance):
+        '''
+        Remplace chaque valeur distincte de la colonne par une autre (plusieurs valeurs peuvent avoir le même remplacement),
+        sans parcourir les lignes une par une. La colonne reçoit ensuite son propre vocabulaire.
+            Parameters :
+                correspondance (dict) : ancienne valeur -> nouvelle valeur (ex : adresse IP -> code pays)
+        '''
+        if self.partage:
+            self.compacte() # les valeurs du vocabulaire partagé absentes de la colonne n'ont pas forcément de remplacement
+        nouveau = Vocabulaire()
+        traduction = np.array([nouveau.code(correspondance[v]) for v in self.vocabulaire.valeurs], dtype=np.int32)
+        if len(self.codes):
+            self.codes = array('i', traduction[np.frombuffer(self.codes, dtype=np.int32)].tobytes())
+        self.vocabulaire = nouveau
+
+    def compacte(self):
+        '''
+        Remplace le vocabulaire partagé par un vocabulaire propre à la colonne, limité à ses valeurs, dans l'ordre de leur première
+        apparition dans la colonne (les memes catégories que si la colonne n'avait jamais partagé de vocabulaire)
+        '''
+        codes = np.frombuffer(self.codes, dtype=np.int32) if len(self.codes) else np.zeros(0, dtype=np.int32)
+        utilises, premieres = np.unique(codes, return_index=True)
+        utilises = utilises[np.argsort(premieres)]
+        traduction = np.zeros(len(self.vocabulaire), dtype=np.int32)
+        traduction[utilises] = np.arange(len(utilises), dtype=np.int32)
+        nouveau = Vocabulaire()
+        for code in utilises:
+            nouveau.code(self.vocabulaire.valeurs[code])
+        self.codes = array('i', traduction[codes].tobytes())
+        self.vocabulaire = nouveau
+        self.partage = False
+
+    def to_categorical(self):
+        '''
+        Retourne la colonne sous forme de pandas.Categorical (les codes ne sont pas recopiés en chaines)
+            Returns :
+                colonne (pd.Categorical) : la colonne
+        '''
+        if self.partage:
+            self.compacte() # catégories limitées aux valeurs de la colonne
+        codes = np.frombuffer(self.codes, dtype=np.int32) if len(self.codes) else np.zeros(0, dtype=np.int32)
+        return pd.Categorical.from_codes(codes, categories=self.vocabulaire.valeurs)
+
+
+def nouvelle_colonne(type_colonne, vocabulaire=None):
+    '''
+    Crée une colonne vide d'un type de TYPES_COLONNES (vocabulaire : voir ColonneCategorielle)
+    '''
+    if type_colonne == 'categorie':
+        return ColonneCategorielle(vocabulaire)
+    if type_colonne == 'entier':
+        return array('q')
+    if type_colonne == 'reel':
+        return array('d')
+    return [] # dates : chaines ISO 8601, converties en une seule fois dans to_dataframe
+
+
+class TableEchanges:
+    '''
+    Table des échanges réseau (une ligne par échange), remplie au fur et à mesure de l'analyse des entrées
+    '''
+
+    def __init__(self, vocabulaires=None):
+        '''
+        Parameters :
+            vocabulaires (dict) : colonne -> Vocabulaire partagé avec d'autres tables (voir vocabulaires_partages),
+                ou None pour que chaque colonne ait son propre vocabulaire
+        '''
+        vocabulaires = vocabulaires or {}
+        self.colonnes = {nom : nouvelle_colonne(TYPES_COLONNES[nom], vocabulaires.get(nom)) for nom in COLONNES_TABLE}
+        self.pages = {} # page_id -> infos de la page (voir infos_page)
+
+    def __len__(self):
+        return len(self.colonnes['requestSize'])
+
+    def ajoute(self, res):
+        '''
+        Ajoute un échange à la table
+            Parameters :
+                res (list) : les attributs de l'échange, dans l'ordre de COLONNES_TABLE (résultat de analyse_entry suivi éventuellement de infos_entree)
+        '''
+        for i, nom in enumerate(COLONNES_TABLE):
+            valeur = res[i] if i < len(res) else VALEURS_DEFAUT[TYPES_COLONNES[nom]]
+            self.colonnes[nom].append(valeur)
+
+    def ajoute_pages(self, pages):
+        '''
+        Renseigne les pages des échanges de la table
+            Parameters :
+                pages (dict) : page_id -> page HAR (voir lecture_har.iter_entries)
+        '''
+        for page_id, page in pages.items():
+            self.pages[page_id] = infos_page(page)
+
+    def to_dataframe(self):
+        '''
+        Construit le DataFrame des échanges à partir des colonnes
+        Les colonnes numériques partagent la mémoire de la table : celle-ci ne doit plus être complétée ensuite
+            Returns :
+                df (pd.DataFrame) : un dataframe avec les colonnes de COLONNES_TABLE et COLONNES_PAGE
+        '''
+        colonnes = {}
+        for nom in COLONNES_TABLE:
+            colonne = self.colonnes[nom]
+            type_colonne = TYPES_COLONNES[nom]
+            if type_colonne == 'categorie':
+                colonnes[nom] = colonne.to_categorical()
+            elif type_colonne == 'date':
+                colonnes[nom] = pd.to_datetime(pd.Series(colonne, dtype=object), utc=True, format='ISO8601')
+            else:
+                dtype = np.int64 if type_colonne == 'entier' else np.float64
+                colonnes[nom] = np.frombuffer(colonne, dtype=dtype) if len(colonne) else np.zeros(0, dtype=dtype)
+        # Infos de la page de chaque échange : une valeur par page, répartie sur les lignes par les codes de la colonne page
+        page = colonnes['page']
+        infos = [self.pages.get(p, (None, float('nan'))) for p in page.categories]
+        debuts = pd.to_datetime(pd.Series([i[0] for i in infos], dtype=object), utc=True, format='ISO8601')
+        colonnes['pageStartedDateTime'] = pd.DatetimeIndex(debuts).take(page.codes, allow_fill=True)
+        colonnes['onLoad'] = np.append(np.array([i[1] for i in infos], dtype=np.float64), np.nan)[page.codes] # code -1 : NaN
+        return pd.DataFrame(colonnes, copy=False)
+
+
+def from_rows(my_data):
+    '''
+    Construit une TableEchanges à partir d'une liste 2D (une ligne par échange)
+        Parameters :
+            my_data : une liste 2D donc chaque ligne contient les attributs ['hostname','tld','domain','requestSize', 'responseSize', 'country'] d'un échange réseau
+        Returns :
+            table (TableEchanges) : la table
+    '''
+    table = TableEchanges()
+    for res in my_data:
+        table.ajoute(res)
+    return table
+
+
+def exporte_echanges(df, fichier, format_export="parquet"):
+    '''
+    Ecrit la table des échanges dans un fichier en colonnes compressé (Parquet ou Feather), lisible ensuite par pyarrow, pandas, DuckDB ...
+    Les colonnes de chaines (catégories) sont écrites avec un encodage par dictionnaire.
+    Nécessite pyarrow, qui n'est importé qu'à l'export.
+        Parameters :
+            df (pd.DataFrame) : le dataframe des échanges (voir TableEchanges.to_dataframe)
+            fichier (string) : le fichier à écrire
+            format_export (string) : un des FORMATS_EXPORT
+    '''
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False) # les catégories deviennent des colonnes dictionnaire
+    if format_export == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, fichier, compression="zstd", use_dictionary=True)
+    elif format_export == "feather":
+        import pyarrow.feather as feather
+        feather.write_feather(table, fichier, compression="zstd")
+    else:
+        raise ValueError(f"Format d'export inconnu : {format_export} (formats possibles : {', '.join(FORMATS_EXPORT)})")
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Modèle des tailles transférées sur le réseau par un échange HAR
+
+bodySize seul sous-estime le volume réellement échangé : les en-tetes sont ignorés, et bodySize vaut 0 ou -1 pour les réponses
+servies depuis le cache, compressées ou reçues en flux selon les navigateurs. Les tailles sont donc calculées ainsi :
+    - requete : headersSize + bodySize
+    - réponse : _transferSize quand le navigateur l'exporte (Chrome : taille totale reçue, en-tetes compris),
+      sinon headersSize + bodySize, et si bodySize est inconnu, content.size - content.compression (taille décodée moins le gain de compression)
+Dans le format HAR, -1 signifie "inconnu" : une taille à -1 (ou absente) ne compte pour rien dans les totaux.
+"""
+
+
+# Composantes des tailles d'un échange, rangées dans la table des échanges (octets, NaN si inconnues)
+COLONNES_TAILLES = ['requestHeadersSize', 'requestBodySize', 'responseHeadersSize', 'responseBodySize', 'transferSize', 'contentSize']
+
+
+def taille_connue(valeur):
+    '''
+    Retourne une taille HAR, ou None si elle est inconnue (absente, -1 ou autre valeur négative)
+    '''
+    return valeur if isinstance(valeur, (int, float)) and valeur >= 0 else None
+
+
+def taille_transfert(entry):
+    '''
+    Retourne la taille totale reçue exportée par le navigateur (_transferSize de la réponse, ou de l'entrée pour les anciennes versions de Chrome)
+    '''
+    reponse = entry["response"]
+    return taille_connue(reponse.get("_transferSize", entry.get("_transferSize")))
+
+
+def taille_requete(entry):
+    '''
+    Retourne le nombre d'octets envoyés pour une requete (en-tetes et corps)
+        Parameters :
+            entry (dict) : l'entrée HAR
+        Returns :
+            taille (int) : la taille en octets
+    '''
+    requete = entry["request"]
+    return int((taille_connue(requete.get("headersSize")) or 0) + (taille_connue(requete.get("bodySize")) or 0))
+
+
+def taille_reponse(entry):
+    '''
+    Retourne le nombre d'octets reçus pour une réponse (voir l'en-tete du module)
+        Parameters :
+            entry (dict) : l'entrée HAR
+        Returns :
+            taille (int) : la taille en octets
+    '''
+    transfert = taille_transfert(entry)
+    if transfert is not None:
+        return int(transfert)
+    reponse = entry["response"]
+    corps = taille_connue(reponse.get("bodySize"))
+    if corps is None:
+        contenu = reponse.get("content", {})
+        decodee = taille_connue(contenu.get("size")) or 0
+        corps = max(decodee - (taille_connue(contenu.get("compression")) or 0), 0)
+    return int((taille_connue(reponse.get("headersSize")) or 0) + corps)
+
+
+def composantes_tailles(entry):
+    '''
+    Retourne les valeurs des colonnes de COLONNES_TAILLES pour une entrée HAR
+        Parameters :
+            entry (dict) : l'entrée HAR
+        Returns :
+            tailles (list) : les composantes des tailles de l'échange (octets, NaN si inconnues)
+    '''
+    requete, reponse = entry["request"], entry["response"]
+    valeurs = [requete.get("headersSize"), requete.get("bodySize"), reponse.get("headersSize"), reponse.get("bodySize"),
+               taille_transfert(entry), reponse.get("content", {}).get("size")]
+    return [float('nan') if taille_connue(v) is None else float(v) for v in valeurs]
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# Les modules du projet sont à la racine du dépôt
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from agregation import calcule_agregats, fusionne_agregats
+
+
+def echanges(attentes, domaine="example.com"):
+    '''
+    Dataframe d'échanges d'une seule page vers un seul domaine, avec les temps d'attente donnés
+    '''
+    n = len(attentes)
+    debut = pd.Timestamp("2024-01-01")
+    return pd.DataFrame({
+        'country' : pd.Categorical(["FR"] * n),
+        'domain' : pd.Categorical([domaine] * n),
+        'requestSize' : np.ones(n, dtype=np.int64),
+        'responseSize' : np.ones(n, dtype=np.int64),
+        'contentSize' : np.ones(n),
+        'time' : np.asarray(attentes, dtype=np.float64),
+        'wait' : np.asarray(attentes, dtype=np.float64),
+        'connect' : np.full(n, -1.0),
+        'page' : pd.Categorical(["page_1"] * n),
+        'startedDateTime' : [debut] * n,
+        'pageStartedDateTime' : [debut] * n,
+        'onLoad' : np.full(n, 1000.0),
+    })
+
+
+def test_quantiles_constants():
+    latences = calcule_agregats(echanges([10.0] * 100)).latences('domain')
+    assert latences.loc['example.com', 'wait_p50'] == 10.0
+    assert latences.loc['example.com', 'wait_p95'] == 10.0
+
+
+def test_quantiles_asymetriques():
+    attentes = [1.0] * 90 + [1000.0] * 10
+    latences = calcule_agregats(echanges(attentes)).latences('country')
+    assert latences.loc['FR', 'wait_p50'] == pytest.approx(np.quantile(attentes, 0.5))
+    assert latences.loc['FR', 'wait_p95'] == pytest.approx(np.quantile(attentes, 0.95))
+
+
+def test_quantiles_fusionnes():
+    # Domaine présent dans les deux fichiers : estimation par l'histogramme, dans les limites observées
+    fusion = fusionne_agregats([calcule_agregats(echanges([10.0] * 100)), calcule_agregats(echanges([10.0] * 50))])
+    latences = fusion.latences('domain')
+    assert latences.loc['example.com', 'wait_p50'] == 10.0
+    assert latences.loc['example.com', 'wait_p95'] == 10.0
+    attentes = list(np.geomspace(1.0, 5000.0, 200))
+    fusion = fusionne_agregats([calcule_agregats(echanges(attentes[::2])), calcule_agregats(echanges(attentes[1::2]))])
+    latences = fusion.latences('domain')
+    assert latences.loc['example.com', 'wait_p50'] == pytest.approx(np.quantile(attentes, 0.5), rel=0.1)
+    assert latences.loc['example.com', 'wait_p95'] == pytest.approx(np.quantile(attentes, 0.95), rel=0.1)
+    assert latences.loc['example.com', 'wait_p95'] <= max(attentes)
+
+
+def test_quantiles_exacts_domaine_d_un_seul_fichier():
+    fusion = fusionne_agregats([calcule_agregats(echanges([1.0, 2.0, 30.0], "a.com")), calcule_agregats(echanges([7.0], "b.com"))])
+    latences = fusion.latences('domain')
+    assert latences.loc['a.com', 'wait_p50'] == 2.0
+    assert latences.loc['b.com', 'wait_p95'] == 7.0
+
+
+def test_taux_reutilisation_sans_timings():
+    # Connexion ouverte, réutilisée (-1, NaN dans la table), nulle, puis deux échanges sans timings (ex : liste sans COLONNES_ENTREE)
+    df = echanges([10.0, 10.0, 10.0, np.nan, np.nan])
+    df['connect'] = [25.0, np.nan, 0.0, np.nan, np.nan]
+    agregats = calcule_agregats(df)
+    assert agregats.par_domaine.loc['example.com', 'count'] == 5
+    assert agregats.par_domaine.loc['example.com', 'mesures'] == 3
+    assert agregats.latences('domain').loc['example.com', 'taux_reutilisation'] == pytest.approx(2 / 3)
+    fusion = fusionne_agregats([agregats, calcule_agregats(echanges([np.nan] * 4))])
+    assert fusion.latences('country').loc['FR', 'taux_reutilisation'] == pytest.approx(2 / 3)
+    assert np.isnan(calcule_agregats(echanges([np.nan] * 4)).latences('domain').loc['example.com', 'taux_reutilisation'])
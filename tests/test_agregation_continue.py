@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import random
+from collections import Counter
+
+import pytest
+
+from agregation_continue import COLONNES_CONTINUES, AgregatsContinus, HyperLogLog, SpaceSaving
+
+
+def test_hyperloglog_petits_ensembles_exacts():
+    # Comptage linéaire : exact tant que deux valeurs ne tombent pas dans le meme registre, à une ou deux unités près ensuite
+    for nb, ecart in ((0, 0), (1, 0), (10, 0), (25, 0), (50, 2), (100, 2)):
+        hll = HyperLogLog()
+        for i in range(nb):
+            hll.ajoute(f"site{i}.com")
+            hll.ajoute(f"site{i}.com") # les doublons ne comptent pas
+        assert hll.estimation() == pytest.approx(nb, abs=ecart)
+
+
+def test_hyperloglog_grands_ensembles():
+    hll, autre = HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        (hll if i % 2 else autre).ajoute(f"site{i}.example.org")
+    assert hll.estimation() == pytest.approx(10000, rel=0.05)
+    hll.fusionne(autre)
+    assert hll.estimation() == pytest.approx(20000, rel=0.05)
+
+
+def test_space_saving_premiers_exacts():
+    # Flux asymétrique (loi de Zipf) sur 5000 domaines : les 15 premiers sont retrouvés avec 150 compteurs
+    rnd = random.Random(0)
+    domaines = [f"site{i}.fr" for i in range(5000)]
+    poids = [1 / (rang + 1) for rang in range(len(domaines))]
+    flux = rnd.choices(domaines, weights=poids, k=50000)
+    space_saving = SpaceSaving(150)
+    for domaine in flux:
+        space_saving.ajoute(domaine)
+    exacts = Counter(flux)
+    assert [d for d, _ in space_saving.premiers(15)] == [d for d, _ in exacts.most_common(15)]
+    for domaine, estime in space_saving.premiers(15):
+        assert exacts[domaine] <= estime <= exacts[domaine] + len(flux) / 150
+
+
+def test_formats_de_sortie():
+    agregats = AgregatsContinus(nb_premiers=2, facteur=2)
+    echanges = [("a.com", 10, 100, "FR"), ("a.com", 10, 100, "FR"), ("b.com", 20, 50, "US"), ("c.com", 1, 1, "FR")]
+    for domaine, envoye, recu, pays in echanges:
+        agregats.ajoute([f"www.{domaine}", "com", domaine, envoye, recu, pays])
+    resultats = agregats.to_dict()
+    assert set(resultats) == {'nb_domain', 'par_pays', 'par_domaine'}
+    assert resultats['nb_domain'] == 3
+    assert resultats['par_pays'] == {'FR' : {'requestSize' : 21, 'responseSize' : 201, 'count' : 3},
+                                     'US' : {'requestSize' : 20, 'responseSize' : 50, 'count' : 1}}
+    assert set(resultats['par_domaine']) == {'a.com', 'b.com'} # les 2 premiers de chaque colonne
+    assert resultats['par_domaine']['a.com'] == {'requestSize' : 20, 'responseSize' : 200, 'count' : 2}
+    table = agregats.to_frame()
+    assert list(table.columns) == ['cle', 'valeur'] + COLONNES_CONTINUES
+    assert list(table['cle']) == ['country'] * 2 + ['domain'] * 2
+    assert list(agregats.serie('country', 'count')) == [1, 3]
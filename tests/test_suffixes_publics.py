@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from suffixes_publics import get_registrable_domain, retire_port
+import table_echanges
+from analyse_fichier_HAR import decoupe_hostnames, get_tld_and_2nd_lvl_domain, get_tld_and_2nd_lvl_domain_columns
+
+
+@pytest.mark.parametrize("host, nom", [
+    ("www.example.com", "www.example.com"),
+    ("www.example.com:8443", "www.example.com"),
+    ("[2001:db8::1]:443", "2001:db8::1"),
+    ("[2001:db8::1]", "2001:db8::1"),
+    ("2001:db8::1", "2001:db8::1"),
+    ("192.0.2.1:8080", "192.0.2.1"),
+])
+def test_retire_port(host, nom):
+    assert retire_port(host) == nom
+
+
+@pytest.mark.parametrize("hostname, domaine", [
+    ("www.example.com", "example.com"),
+    ("a.b.example.co.uk", "example.co.uk"),
+    ("WWW.Sydney.EDU.au.", "sydney.edu.au"),
+    ("co.uk", "co.uk"), # suffixe public
+    # ports
+    ("www.example.com:8443", "example.com"),
+    ("a.b.example.co.uk:8443", "example.co.uk"),
+    # règle joker (*.ck) et exception (!www.ck)
+    ("a.b.ck", "a.b.ck"),
+    ("x.www.ck", "www.ck"),
+    ("foo.bar.kawasaki.jp", "foo.bar.kawasaki.jp"),
+    ("www.city.kawasaki.jp", "city.kawasaki.jp"),
+    # adresses IP
+    ("192.0.2.1", "192.0.2.1"),
+    ("192.0.2.1:8080", "192.0.2.1"),
+    ("[2001:db8::1]:443", "2001:db8::1"),
+])
+def test_get_registrable_domain(hostname, domaine):
+    assert get_registrable_domain(hostname) == domaine
+
+
+def test_tld_sans_port():
+    assert get_tld_and_2nd_lvl_domain("a.b.example.co.uk:8443") == ("uk", "example.co.uk")
+
+
+def test_decoupe_hostnames():
+    hostnames = ["www.example.co.uk", "cdn.example.co.uk:8443", "www.example.co.uk", "192.0.2.1"]
+    assert get_tld_and_2nd_lvl_domain_columns(set(hostnames)) == (
+        {"www.example.co.uk" : "uk", "cdn.example.co.uk:8443" : "uk", "192.0.2.1" : "1"},
+        {"www.example.co.uk" : "example.co.uk", "cdn.example.co.uk:8443" : "example.co.uk", "192.0.2.1" : "192.0.2.1"})
+    # Colonnes tld et domain remplies avec le hostname (analyse_entry avec decoupe=False), puis découpées une fois par hostname
+    table = table_echanges.from_rows([[h, h, h, 0, 0, "FR"] for h in hostnames])
+    decoupe_hostnames([table])
+    df = table.to_dataframe()
+    assert list(df['tld']) == ["uk", "uk", "uk", "1"]
+    assert list(df['domain']) == ["example.co.uk", "example.co.uk", "example.co.uk", "192.0.2.1"]
+    assert list(df['domain'].cat.categories) == ["example.co.uk", "192.0.2.1"]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import math
+
+import pytest
+
+from tailles import composantes_tailles, taille_reponse, taille_requete
+
+
+def entree(reponse, requete=None, **champs):
+    '''
+    Entrée HAR minimale avec la réponse (et la requete) données
+    '''
+    if requete is None:
+        requete = {"headersSize" : 100, "bodySize" : 0}
+    return {"request" : requete, "response" : reponse, **champs}
+
+
+@pytest.mark.parametrize("reponse, champs, attendu", [
+    # _transferSize exporté par le navigateur : utilisé tel quel
+    ({"_transferSize" : 5000, "headersSize" : 300, "bodySize" : 1000}, {}, 5000),
+    ({"headersSize" : 300, "bodySize" : 1000}, {"_transferSize" : 4000}, 4000), # anciennes versions de Chrome : sur l'entrée
+    ({"_transferSize" : 5000}, {"_transferSize" : 4000}, 5000), # celui de la réponse prime
+    # _transferSize inconnu : en-tetes et corps
+    ({"_transferSize" : -1, "headersSize" : 300, "bodySize" : 1000}, {}, 1300),
+    ({"headersSize" : 300, "bodySize" : 1000}, {}, 1300),
+    ({"headersSize" : 300, "bodySize" : 0, "content" : {"size" : 8000}}, {}, 300), # corps nul (ex : réponse en cache)
+    # bodySize inconnu : taille décodée moins le gain de compression
+    ({"headersSize" : 300, "bodySize" : -1, "content" : {"size" : 8000, "compression" : 6000}}, {}, 2300),
+    ({"headersSize" : 300, "content" : {"size" : 8000}}, {}, 8300),
+    ({"headersSize" : 300, "bodySize" : -1, "content" : {"size" : 8000, "compression" : -1}}, {}, 8300),
+    ({"headersSize" : 300, "bodySize" : -1, "content" : {"size" : 1000, "compression" : 6000}}, {}, 300), # jamais négatif
+    # tailles à -1 ou absentes : ne comptent pour rien
+    ({"headersSize" : -1, "bodySize" : 1000}, {}, 1000),
+    ({"headersSize" : -1, "bodySize" : -1, "content" : {"size" : -1}}, {}, 0),
+    ({}, {}, 0),
+])
+def test_taille_reponse(reponse, champs, attendu):
+    taille = taille_reponse(entree(reponse, **champs))
+    assert taille == attendu
+    assert isinstance(taille, int)
+
+
+@pytest.mark.parametrize("requete, attendu", [
+    ({"headersSize" : 100, "bodySize" : 50}, 150),
+    ({"headersSize" : -1, "bodySize" : 50}, 50),
+    ({"headersSize" : 100, "bodySize" : -1}, 100),
+    ({}, 0),
+])
+def test_taille_requete(requete, attendu):
+    assert taille_requete(entree({}, requete)) == attendu
+
+
+def test_composantes_tailles_inconnues():
+    tailles = composantes_tailles(entree({"headersSize" : -1, "bodySize" : 1000, "content" : {"size" : 2000}}, {"headersSize" : 100, "bodySize" : -1}))
+    attendues = [100.0, math.nan, math.nan, 1000.0, math.nan, 2000.0]
+    assert tailles == pytest.approx(attendues, nan_ok=True)